@@ -0,0 +1,134 @@
+"""Memory held per tracked fund by each integration.
+
+Run from the repository root in a Home Assistant development environment:
+
+    python benchmarks/memory.py --funds 500
+
+For each integration this parses the fixture page of every fund the way the
+sensors do, keeps the results the way the coordinators and the response cache
+keep them, and reports the bytes held per fund. It also reports what parsing
+leaves behind for the garbage collector, and the bytes per fund after a
+restart, when the data comes back from the store.
+"""
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+
+from homeassistant.helpers.json import json_bytes
+from homeassistant.util.json import json_loads
+
+from run import INTEGRATIONS, Integration, _import
+from server import MAX_ROWS, FundServer
+
+FETCHED = "2024-03-15T18:00:00+00:00"
+
+
+def _traced() -> int:
+    return tracemalloc.get_traced_memory()[0]
+
+
+def parse_all(integration: Integration, server: FundServer, funds: list) -> dict:
+    """Return the data of every fund, as the coordinator keeps it."""
+    if integration.source is None:
+        chunks = [funds[i:i + MAX_ROWS] for i in range(0, len(funds), MAX_ROWS)]
+        return {
+            row["key"].upper(): row
+            for chunk in chunks
+            for row in integration.sensor.parse_response(
+                integration.body(server, chunk)
+            )["rows"]
+        }
+    cache = integration.cache.ResponseCache()
+    data = {}
+    for fund in funds:
+        body = integration.body(server, [fund])
+        data[fund] = integration.parse(body, [fund])[0]
+        cache.store(integration.source.url(fund), {}, body, data[fund])
+    # The response cache lives as long as the data
+    data[None] = cache
+    return data
+
+
+def keep(integration: Integration, data: dict) -> list:
+    """Return what the sensors keep besides the coordinator data."""
+    if integration.source is None:
+        snapshot = _import(integration.name, "snapshot")
+        return [snapshot.FundSnapshot(row) for row in data.values()]
+    return []
+
+
+def measure(integration: Integration, server: FundServer, count: int) -> dict:
+    """Return the bytes held per fund, fresh and after a restart."""
+    funds = [f"FUND{index}" for index in range(count)]
+    compact = _import("fund_engine", "compact").compact
+
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        start = _traced()
+        data = parse_all(integration, server, funds)
+        sensors = keep(integration, data)
+        uncollected = _traced() - start
+        gc.collect()
+        held = _traced() - start
+
+        stored = json_bytes(
+            {
+                fund: {"data": fund_data, "fetched": FETCHED}
+                for fund, fund_data in data.items()
+                if fund is not None
+            }
+        )
+        del data, sensors
+        gc.collect()
+        start = _traced()
+        restored = {
+            fund: stored_fund["data"]
+            for fund, stored_fund in compact(json_loads(stored)).items()
+        }
+        sensors = keep(integration, restored)
+        restored_bytes = _traced() - start
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    return {
+        "funds": count,
+        "bytes_per_fund": round(held / count),
+        "garbage_per_fund": round((uncollected - held) / count),
+        "restored_bytes_per_fund": round(restored_bytes / count),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--funds", default=500, type=int, help="number of funds to track"
+    )
+    parser.add_argument(
+        "--integrations",
+        default=list(INTEGRATIONS),
+        type=lambda value: value.split(","),
+        help="comma separated integrations to measure",
+    )
+    parser.add_argument(
+        "--output", help="write the results to this file instead of stdout"
+    )
+    args = parser.parse_args()
+    server = FundServer()
+    results = {
+        name: measure(Integration(name, server.urls()[name]), server, args.funds)
+        for name in args.integrations
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
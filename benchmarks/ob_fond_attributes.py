@@ -0,0 +1,156 @@
+"""Compare the cost of reading the ob_fond sensor properties.
+
+Run from the repository root in a Home Assistant development environment:
+
+    python benchmarks/ob_fond_attributes.py
+"""
+import timeit
+
+from run import _import
+
+snapshot = _import("ob_fond", "snapshot")
+ATTRIBUTION = snapshot.ATTRIBUTION
+FundSnapshot = snapshot.FundSnapshot
+
+ROW = {
+    "key": "DK-GLBIX.OSE",
+    "values": {
+        "LONG_NAME": "DNB Global Indeks A",
+        "PRICE": 3512.123456,
+        "DATE": "20240315",
+        "PRICECHANGEPCT": 0.42,
+        "RET1WEEK": 1.12,
+        "RET1M": 2.51,
+        "RET3M": 7.9,
+        "RET6M": 12.4,
+        "RETY2D": 8.33,
+        "RETGAVG1YR": 24.1,
+        "RETGAVG2YR": 11.7,
+        "RETGAVG3YR": 12.2,
+        "RETGAVG4YR": 14.9,
+        "RETGAVG5YR": 13.1,
+        "RETGAVG7YR": 12.0,
+        "RETGAVG10YR": 13.5,
+        "RETGAVG20YR": None,
+        "MANAGEMENTFEE": 0.2,
+        "MAXREDEMPTIONFEE": 0,
+        "MAXSALECHARGE": 0,
+        "BENCHMARKNAME": "MSCI World Index",
+        "QUOTATIONCURRENCY": "NOK",
+    },
+}
+
+
+class PerAccess:
+    """The properties as computed before the snapshot, on every access.
+
+    Like the sensor did, this holds the whole API response and looks up the
+    first row on every access.
+    """
+
+    def __init__(self, api_data):
+        self._api_data = api_data
+
+    @property
+    def name(self):
+        return self._api_data["rows"][0]["values"]["LONG_NAME"]
+
+    @property
+    def unique_id(self):
+        return self._api_data["rows"][0]["key"]
+
+    @property
+    def state(self):
+        return round(self._api_data["rows"][0]["values"]["PRICE"], 2)
+
+    @property
+    def icon(self):
+        iconvalue = self._api_data["rows"][0]["values"]["PRICECHANGEPCT"]
+        if iconvalue > 0:
+            return "mdi:arrow-top-right-thick"
+        elif iconvalue < 0:
+            return "mdi:arrow-bottom-right-thick"
+        elif iconvalue == 0:
+            return "mdi:arrow-right-thick"
+        else:
+            return "mdi:alert-circle"
+
+    @property
+    def state_attributes(self):
+        osedate = self._api_data["rows"][0]["values"]["DATE"]
+        date = f"{osedate[6:8]}.{osedate[4:6]}.{osedate[0:4]}"
+        attributes = {
+            "attribution": ATTRIBUTION,
+            "Dato": date,
+            "Forvaltningshonorar": str(self._api_data["rows"][0]["values"]["MANAGEMENTFEE"]) + " %",
+            "Kjøpsavgift": str(self._api_data["rows"][0]["values"]["MAXREDEMPTIONFEE"]) + " %",
+            "Salgsavgift": str(self._api_data["rows"][0]["values"]["MAXSALECHARGE"]) + " %",
+            "Referanseindeks": self._api_data["rows"][0]["values"]["BENCHMARKNAME"],
+            "Intradag": str(self._api_data["rows"][0]["values"]["PRICECHANGEPCT"]) + " %",
+        }
+        apikeys = (
+            "RET1WEEK", "RET1M", "RET3M", "RET6M", "RETY2D", "RETGAVG1YR", "RETGAVG2YR",
+            "RETGAVG3YR", "RETGAVG4YR", "RETGAVG5YR", "RETGAVG7YR", "RETGAVG10YR", "RETGAVG20YR"
+        )
+        attr = (
+            "Uke", "Måned", "3 Måneder", "6 Måneder", "Hittil i år",
+            "1 år", "2 år", "3 år", "4 år", "5 år", "7 år", "10 år", "20 år"
+        )
+        for index, data in enumerate(apikeys):
+            if self._api_data["rows"][0]["values"][data]:
+                attributes[attr[index]] = str(self._api_data["rows"][0]["values"][data]) + " %"
+        return attributes
+
+
+class Snapshotted:
+    """The properties as served by the sensor from its snapshot."""
+
+    def __init__(self, api_data):
+        self._snapshot = FundSnapshot(api_data)
+
+    @property
+    def name(self):
+        return self._snapshot.name
+
+    @property
+    def unique_id(self):
+        return self._snapshot.unique_id
+
+    @property
+    def state(self):
+        return self._snapshot.state
+
+    @property
+    def icon(self):
+        return self._snapshot.icon
+
+    @property
+    def state_attributes(self):
+        return self._snapshot.attributes
+
+
+def read_all(sensor):
+    """Read every property Home Assistant reads on a state write."""
+    return (
+        sensor.name,
+        sensor.unique_id,
+        sensor.state,
+        sensor.icon,
+        sensor.state_attributes,
+    )
+
+
+def main(number=100_000):
+    per_access = PerAccess({"rows": [ROW]})
+    snapshotted = Snapshotted(ROW)
+    assert read_all(per_access) == read_all(snapshotted)
+    before = min(timeit.repeat(lambda: read_all(per_access), number=number, repeat=5))
+    after = min(timeit.repeat(lambda: read_all(snapshotted), number=number, repeat=5))
+    build = min(timeit.repeat(lambda: FundSnapshot(ROW), number=number, repeat=5))
+    print(f"per access: {before / number * 1e6:.2f} µs per state write")
+    print(f"snapshot:   {after / number * 1e6:.2f} µs per state write")
+    print(f"build:      {build / number * 1e6:.2f} µs once per update")
+
+
+if __name__ == "__main__":
+    main()
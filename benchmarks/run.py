@@ -0,0 +1,345 @@
+"""Offline benchmarks of the fund integrations against the saved fixture pages.
+
+Run from the repository root in a Home Assistant development environment:
+
+    python benchmarks/run.py --funds 1,10,100,500 --output results.json
+
+For each integration this measures the parse time per fund, and for each
+number of funds the end-to-end refresh time, the peak memory and how long the
+event loop was blocked. The refreshes go through the integration's own fetch
+engine against a local stand-in server with configurable latency and error
+rate. Pages are streamed and cut after the sections the parsers need, unless
+--no-streaming is given. The Morningstar pages are parsed with --parser, and
+only their needed sections unless --no-parse-only is given. Results are
+written as JSON so runs can be compared over time.
+"""
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+
+import aiohttp
+
+from server import MAX_ROWS, FundServer
+
+# The integrations import the shared fund_engine relatively, so they are loaded
+# as a package the way Home Assistant loads custom_components
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "custom_components"
+if PACKAGE not in sys.modules:
+    sys.modules[PACKAGE] = types.ModuleType(PACKAGE)
+    sys.modules[PACKAGE].__path__ = [ROOT]
+
+INTEGRATIONS = ("morningstar", "lt_morningstar", "euronext", "ob_fond")
+PARSE_ROUNDS = 50
+PARSE_WORKERS = 2
+
+
+class LoopMonitor:
+    """Measure how late the event loop wakes up a 1 ms ticker."""
+
+    INTERVAL = 0.001
+
+    def __init__(self):
+        self.max = 0.0
+        self.total = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.INTERVAL)
+            lag = loop.time() - start - self.INTERVAL
+            if lag > 0:
+                self.max = max(self.max, lag)
+                self.total += lag
+
+    async def __aenter__(self):
+        self._task = asyncio.ensure_future(self._run())
+        await asyncio.sleep(0)
+        return self
+
+    async def __aexit__(self, *_):
+        self._task.cancel()
+
+
+def _import(integration: str, module: str):
+    return __import__(f"{PACKAGE}.{integration}.{module}", fromlist=[module])
+
+
+class Integration:
+    """Fetch and parse the funds of one integration the way its sensors do."""
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        streaming: bool = True,
+        processes: bool = False,
+        parser: str = "html.parser",
+        parse_only: bool = True,
+    ):
+        self.name = name
+        self.url = url
+        self.streaming = streaming
+        self.processes = processes
+        self.parser = parser
+        self.parse_only = parse_only
+        self.engine = _import("fund_engine", "engine")
+        self.cache = _import("fund_engine", "cache")
+        self.sensor = _import(name, "sensor")
+        self.parallel = getattr(self.sensor, "DEFAULT_PARALLEL_REQUESTS", None)
+        self.source = self._source()
+
+    def _source(self):
+        sensor = self.sensor
+        pages = _import("fund_engine", "pages")
+        if self.name == "morningstar":
+            return pages.SnapshotSource(
+                self.url,
+                sensor.parse_morningstar,
+                sensor.MORNINGSTAR_SECTIONS,
+                self.parser,
+                self.parse_only,
+                stream_end=sensor.MORNINGSTAR_END if self.streaming else None,
+            )
+        if self.name == "lt_morningstar":
+            return pages.LtSource(
+                self.parser, self.parse_only, self.streaming, url=self.url
+            )
+        if self.name == "euronext":
+            return sensor.EuronextSource(self.url, self.streaming)
+        return None
+
+    def body(self, server: FundServer, funds: list) -> str:
+        """Return the response body the server sends for the funds."""
+        if self.source is None:
+            values = server.row["values"]
+            return json.dumps(
+                {"rows": [{"key": fund, "values": values} for fund in funds]}
+            )
+        page = server.pages[{"lt_morningstar": "lt"}.get(self.name, self.name)]
+        page = page.replace("{fund}", funds[0])
+        if self.source.stream_end is not None:
+            # The engine stops reading where the needed sections end
+            page = page[: self.source.stream_end.find(page)]
+        return page
+
+    def parse(self, body: str, funds: list) -> list:
+        """Parse a response body into the data the sensors serve."""
+        if self.source is None:
+            snapshot = _import(self.name, "snapshot")
+            rows = self.sensor.parse_response(body)["rows"]
+            return [snapshot.FundSnapshot(row) for row in rows]
+        return [self.source.parse(body, funds[0], self.source.url(funds[0]))]
+
+    async def async_refresh(self, engine, pool, cache, funds: list) -> int:
+        """Refresh all funds once, returning how many failed."""
+        if self.source is None:
+            chunks = [funds[i:i + MAX_ROWS] for i in range(0, len(funds), MAX_ROWS)]
+            responses = await asyncio.gather(
+                *(
+                    self.sensor.async_api_request(engine, chunk, self.url)
+                    for chunk in chunks
+                )
+            )
+            snapshot = _import(self.name, "snapshot")
+            snapshots = [
+                snapshot.FundSnapshot(row)
+                for response in responses
+                for row in (response or {}).get("rows", [])
+            ]
+            return len(funds) - len(snapshots)
+
+        semaphore = asyncio.Semaphore(self.parallel or len(funds))
+
+        async def fetch(fund):
+            async with semaphore:
+                return await engine.async_fetch(self.source, fund, pool, cache)
+
+        results = await asyncio.gather(*(fetch(fund) for fund in funds))
+        return sum(result is None for result in results)
+
+
+def measure_parse(integration: Integration, server: FundServer) -> dict:
+    """Return the parse time per fund in milliseconds."""
+    count = MAX_ROWS if integration.source is None else 1
+    funds = [f"FUND{index}" for index in range(count)]
+    body = integration.body(server, funds)
+    times = []
+    for _ in range(PARSE_ROUNDS):
+        start = time.perf_counter()
+        integration.parse(body, funds)
+        times.append((time.perf_counter() - start) * 1000 / len(funds))
+    return {
+        "median_ms": round(statistics.median(times), 4),
+        "min_ms": round(min(times), 4),
+        "body_bytes": len(body.encode()),
+    }
+
+
+async def async_measure_refresh(
+    integration: Integration, session, count: int, repeat: int
+) -> dict:
+    """Return the refresh time, loop blocking and peak memory for count funds."""
+    funds = [f"FUND{index}" for index in range(count)]
+
+    async def refresh():
+        engine = integration.engine.FetchEngine(None, session=session)
+        pool = integration.engine.ParsePool(
+            PARSE_WORKERS, integration.name, integration.processes
+        )
+        cache = integration.cache.ResponseCache()
+        try:
+            start = time.perf_counter()
+            failed = await integration.async_refresh(engine, pool, cache, funds)
+            return time.perf_counter() - start, failed, engine.requests, pool
+        finally:
+            pool.shutdown()
+
+    runs = []
+    for _ in range(repeat):
+        async with LoopMonitor() as monitor:
+            seconds, failed, requests, pool = await refresh()
+        runs.append((seconds, failed, requests, monitor, pool))
+
+    tracemalloc.start()
+    await refresh()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = [run[0] for run in runs]
+    return {
+        "funds": count,
+        "median_s": round(statistics.median(seconds), 4),
+        "min_s": round(min(seconds), 4),
+        "failed": max(run[1] for run in runs),
+        "requests": max(run[2] for run in runs),
+        "loop_block_max_ms": round(max(run[3].max for run in runs) * 1000, 3),
+        "loop_block_total_ms": round(
+            statistics.median(run[3].total for run in runs) * 1000, 3
+        ),
+        "parse_loop_lag_ms": round(
+            statistics.median(run[4].loop_lag for run in runs) * 1000, 3
+        ),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+async def async_main(args) -> dict:
+    server = FundServer(args.latency, args.error_rate, args.seed)
+    server.start()
+    urls = server.urls()
+    results = {}
+    try:
+        async with aiohttp.ClientSession() as session:
+            for name in args.integrations:
+                integration = Integration(
+                    name,
+                    urls[name],
+                    args.streaming,
+                    args.parse_processes,
+                    args.parser,
+                    args.parse_only,
+                )
+                results[name] = {
+                    "parse": measure_parse(integration, server),
+                    "refresh": [
+                        await async_measure_refresh(
+                            integration, session, count, args.repeat
+                        )
+                        for count in args.funds
+                    ],
+                }
+    finally:
+        server.stop()
+    return {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency_s": args.latency,
+            "error_rate": args.error_rate,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "streaming": args.streaming,
+            "parse_processes": args.parse_processes,
+            "parser": args.parser,
+            "parse_only": args.parse_only,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--funds",
+        default=[1, 10, 100, 500],
+        type=lambda value: [int(count) for count in value.split(",")],
+        help="comma separated numbers of funds to refresh",
+    )
+    parser.add_argument(
+        "--integrations",
+        default=list(INTEGRATIONS),
+        type=lambda value: value.split(","),
+        help="comma separated integrations to benchmark",
+    )
+    parser.add_argument(
+        "--latency", default=0.05, type=float, help="mean server latency in seconds"
+    )
+    parser.add_argument(
+        "--error-rate", default=0.0, type=float, help="share of 503 responses"
+    )
+    parser.add_argument(
+        "--repeat", default=3, type=int, help="refreshes per measurement"
+    )
+    parser.add_argument(
+        "--seed", default=0, type=int, help="seed of the latency and errors"
+    )
+    parser.add_argument(
+        "--no-streaming",
+        dest="streaming",
+        action="store_false",
+        help="read whole pages instead of stopping after the needed sections",
+    )
+    parser.add_argument(
+        "--parser",
+        default="html.parser",
+        choices=("html.parser", "lxml"),
+        help="parser of the Morningstar pages",
+    )
+    parser.add_argument(
+        "--no-parse-only",
+        dest="parse_only",
+        action="store_false",
+        help="parse whole Morningstar pages instead of only the needed sections",
+    )
+    parser.add_argument(
+        "--parse-processes",
+        action="store_true",
+        help="parse in worker processes instead of threads",
+    )
+    parser.add_argument(
+        "--output", help="write the results to this file instead of stdout"
+    )
+    args = parser.parse_args()
+    results = asyncio.run(async_main(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
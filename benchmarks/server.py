@@ -0,0 +1,116 @@
+"""Local stand-in for the fund providers, serving the saved fixture pages."""
+import asyncio
+import copy
+import json
+import os
+import random
+import re
+import threading
+
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+MAX_ROWS = 25
+SECTOR = re.compile(r"ITEM_SECTOR==s([^|]+)")
+
+
+def _read(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as fixture:
+        return fixture.read()
+
+
+class FundServer:
+    """Serve every source from one local port, with latency and errors."""
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self.pages = {
+            "morningstar": _read("morningstar.html"),
+            "lt": _read("lt_morningstar.html"),
+            "euronext": _read("euronext.html"),
+        }
+        self.row = json.loads(_read("ob_fond.json"))["rows"][0]
+        self._runner = None
+        self._loop = None
+        self._thread = None
+        self.url = None
+
+    async def _delay(self):
+        """Wait like a remote server would, or fail at the error rate."""
+        self.requests += 1
+        await asyncio.sleep(self.latency * self._random.uniform(0.5, 1.5))
+        if self._random.random() < self.error_rate:
+            raise web.HTTPServiceUnavailable()
+
+    async def _snapshot(self, request: web.Request) -> web.Response:
+        await self._delay()
+        page = self.pages[request.match_info["site"]]
+        return web.Response(
+            text=page.replace("{fund}", request.query.get("id", "")),
+            content_type="text/html",
+        )
+
+    async def _quote(self, request: web.Request) -> web.Response:
+        await self._delay()
+        page = self.pages["euronext"].replace("{fund}", request.match_info["fund"])
+        return web.Response(text=page, content_type="text/html")
+
+    async def _components(self, request: web.Request) -> web.Response:
+        await self._delay()
+        rows = []
+        for fund in SECTOR.findall(request.query.get("filter", ""))[:MAX_ROWS]:
+            row = copy.deepcopy(self.row)
+            row["key"] = fund
+            row["values"]["LONG_NAME"] = f"{row['values']['LONG_NAME']} {fund}"
+            rows.append(row)
+        return web.json_response({"rows": rows})
+
+    async def async_start(self, host: str = "127.0.0.1", port: int = 0):
+        """Start serving and set url to the base url of the server."""
+        app = web.Application()
+        app.router.add_get("/{site:morningstar|lt}/snapshot.aspx", self._snapshot)
+        app.router.add_post("/euronext/getDetailedQuote/{fund}", self._quote)
+        app.router.add_get("/oslobors/components", self._components)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+
+    async def async_stop(self):
+        """Stop serving."""
+        await self._runner.cleanup()
+
+    def start(self):
+        """Serve from a thread with its own event loop, apart from the measured one."""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.async_start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fund_server", daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        """Stop serving and the server thread."""
+        asyncio.run_coroutine_threadsafe(self.async_stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def urls(self) -> dict:
+        """Return the url templates of each source on this server."""
+        return {
+            "morningstar": f"{self.url}/morningstar/snapshot.aspx?id={{}}",
+            "lt_morningstar": f"{self.url}/lt/snapshot.aspx?id={{}}",
+            "euronext": f"{self.url}/euronext/getDetailedQuote/{{}}",
+            "ob_fond": f"{self.url}/oslobors/components?filter={{}}",
+        }
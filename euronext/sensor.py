@@ -2,67 +2,174 @@
 import asyncio
 import datetime
 import logging
+import re
+import time
 
-from lxml import html
 import aiohttp
-import async_timeout
+from lxml import etree, html
 import voluptuous as vol
 
 from homeassistant.components.sensor import PLATFORM_SCHEMA
-from homeassistant.const import ATTR_ATTRIBUTION, CONF_CURRENCY, CONF_SCAN_INTERVAL
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.const import (
+    ATTR_ATTRIBUTION,
+    CONF_CURRENCY,
+    CONF_SCAN_INTERVAL,
+    EVENT_HOMEASSISTANT_STOP,
+)
+from homeassistant.core import callback
 from homeassistant.helpers.entity import Entity
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.update_coordinator import CoordinatorEntity, UpdateFailed
+import homeassistant.util.dt as dt_util
+
+from ..fund_engine.cache import ResponseCache
+from ..fund_engine.compact import compact
+from ..fund_engine.coordinator import FundCoordinator
+from ..fund_engine.engine import (
+    FetchEngine,
+    ParsePool,
+    Source,
+    StreamEnd,
+    async_get_engine,
+    trend_icon,
+)
+from ..fund_engine.history import (
+    HistoryStore,
+    async_get_history,
+    async_register_get_history,
+)
+from ..fund_engine.market import is_open, parse_date
+from ..fund_engine.metrics import Metrics, async_get_metrics
+from ..fund_engine.numeric import numeric_attributes, to_float
+from ..fund_engine.store import FundStore, async_get_store
 
 _LOGGER = logging.getLogger(__name__)
+CONF_BULK = "bulk"
+CONF_DIAGNOSTICS = "diagnostics"
 CONF_FUNDS = "funds"
+CONF_INTRADAY = "intraday"
+CONF_INTRADAY_INTERVAL = "intraday_interval"
+CONF_NUMERIC = "numeric"
+CONF_PARALLEL_REQUESTS = "parallel_requests"
+CONF_PARSE_WORKERS = "parse_workers"
+CONF_STREAMING = "streaming"
+CONF_TICK = "tick"
+DEFAULT_INTRADAY_INTERVAL = datetime.timedelta(seconds=10)
+DEFAULT_PARALLEL_REQUESTS = 5
+DEFAULT_PARSE_WORKERS = 2
 DEFAULT_SCAN_INTERVAL = datetime.timedelta(minutes=15)
+MARKET_CLOSES = datetime.time(23)
+MARKET_OPENS = datetime.time(8)
+# Continuous trading on the Euronext cash markets, in Oslo time
+INTRADAY_CLOSES = datetime.time(17, 30)
+INTRADAY_OPENS = datetime.time(9)
+INTRADAY_TIMEOUT = 5
 DOMAIN = "euronext"
+URL = "https://live.euronext.com/en/ajax/getDetailedQuote/{}"
+# The nodes process_data reads as they close in the quote, to stop reading there
+STREAM_END = StreamEnd(
+    ("<strong", "</strong>"),
+    ("header-instrument-currency", "</span>"),
+    ("header-instrument-price", "</span>"),
+    ("text-ui-grey-1", "</span>"),
+    ("last-price-date-time", "</div>"),
+)
+# The intraday polls only need the price, found without building a tree
+PRICE = re.compile(r'id="header-instrument-price"[^>]*>([^<]+)<')
+# Compiled once and shared by the parse workers, plain strings keep no tree alive
+XPATH_NAME = etree.XPath("//strong/text()", smart_strings=False)
+XPATH_PRICE = etree.XPath(
+    "//span[@id='header-instrument-price']/text()", smart_strings=False
+)
+XPATH_CURRENCY = etree.XPath(
+    "//span[@id='header-instrument-currency']/text()", smart_strings=False
+)
+XPATH_DATE = etree.XPath(
+    "//div[contains(@class, 'last-price-date-time')]/text()", smart_strings=False
+)
+XPATH_CHANGE = etree.XPath(
+    "//span[@class='text-ui-grey-1 mr-2']/text()", smart_strings=False
+)
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     {
         vol.Required(CONF_FUNDS): vol.All(cv.ensure_list, [cv.string]),
         vol.Optional(CONF_CURRENCY): cv.string,
         vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL): cv.time_period,
+        vol.Optional(CONF_PARSE_WORKERS, default=DEFAULT_PARSE_WORKERS): cv.positive_int,
+        vol.Optional(CONF_NUMERIC, default=False): cv.boolean,
+        vol.Optional(CONF_DIAGNOSTICS, default=False): cv.boolean,
+        vol.Optional(CONF_BULK, default=False): cv.boolean,
+        vol.Optional(CONF_STREAMING, default=False): cv.boolean,
+        vol.Optional(
+            CONF_PARALLEL_REQUESTS, default=DEFAULT_PARALLEL_REQUESTS
+        ): cv.positive_int,
+        vol.Optional(CONF_INTRADAY, default=[]): vol.All(cv.ensure_list, [cv.string]),
+        vol.Optional(
+            CONF_INTRADAY_INTERVAL, default=DEFAULT_INTRADAY_INTERVAL
+        ): vol.All(cv.time_period, vol.Range(min=datetime.timedelta(seconds=1))),
+        vol.Optional(CONF_TICK, default=0): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
     }
 )
 
+class EuronextSource(Source):
+    """Detailed quotes from Euronext Live."""
 
-async def async_api_call(session: object, fund: str):
-    data = "theme_name=euronext_live"
-    head = {"content-type": "application/x-www-form-urlencoded; charset=UTF-8"}
-    url = f"https://live.euronext.com/en/ajax/getDetailedQuote/{fund}"
-    try:
-        async with async_timeout.timeout(10):
-            async with session.post(url, data=data, headers=head) as response:
-                response_text = await response.text()
-    except (asyncio.TimeoutError, aiohttp.ClientError):
-        _LOGGER.warning("Unable to scrape data for %s", fund)
-        return None
-    return html.fromstring(response_text)
+    name = "Euronext"
+    method = "POST"
+    # The quotes carry no validators, unchanged responses are found by their hash
+    conditional = False
+
+    def __init__(self, url: str = URL, streaming: bool = False):
+        self._url = url
+        self.stream_end = STREAM_END if streaming else None
+
+    def url(self, fund: str) -> str:
+        return self._url.format(fund.upper())
+
+    def request(self, fund: str) -> dict:
+        return {
+            "data": "theme_name=euronext_live",
+            "headers": {
+                "content-type": "application/x-www-form-urlencoded; charset=UTF-8"
+            },
+        }
 
+    def parse(self, body: str, fund: str, url: str) -> dict:
+        return compact(process_data(html.fromstring(body), fund.upper()))
 
-async def async_get_process_data(session: object, fund: str) -> dict:
-    html = await async_api_call(session, fund.upper())
-    if html is None:
+
+SOURCE = EuronextSource()
+
+
+async def async_get_process_data(
+    engine: FetchEngine,
+    fund: str,
+    cache: ResponseCache,
+    pool: ParsePool,
+    metrics: Metrics = None,
+    source: EuronextSource = SOURCE,
+) -> dict:
+    data = await engine.async_fetch(source, fund, pool, cache, metrics)
+    if data is None:
         _LOGGER.info("Failed to retreive data for %s", fund)
-        return None
+    return data
+
+
+def process_data(html, fund: str) -> dict:
     try:
         """Processing the data to be used"""
-        name = html.xpath("//strong/text()")[0]
-        state = html.xpath("//span[@id='header-instrument-price']/text()")[0].replace(",", "")
-        unit = html.xpath("//span[@id='header-instrument-currency']/text()")[0].strip()
-        date = html.xpath("//div[contains(@class, 'last-price-date-time')]/text()")[1].replace("/", ".").strip()
-        day = float(html.xpath("//span[@class='text-ui-grey-1 mr-2']/text()")[0][1:-2])
+        name = XPATH_NAME(html)[0]
+        state = XPATH_PRICE(html)[0].replace(",", "")
+        unit = XPATH_CURRENCY(html)[0].strip()
+        date = XPATH_DATE(html)[1].replace("/", ".").strip()
+        day = float(XPATH_CHANGE(html)[0][1:-2])
         unique = fund.lower()
         url = f"https://live.euronext.com/nb/product/funds/{unique}"
-        icon = (
-            "mdi:trending-up"
-            if day > 0
-            else "mdi:trending-down"
-            if day < 0
-            else "mdi:trending-neutral"
-        )
+        icon = trend_icon(day)
         attr = {
             ATTR_ATTRIBUTION: "Data provided by Euronext",
             "Dato": date,
@@ -79,36 +186,343 @@ async def async_get_process_data(session: object, fund: str) -> dict:
         }
         _LOGGER.info("Successfully processed data for %s", name)
         return data
-    except (IndexError, AttributeError):
+    except (IndexError, AttributeError, ValueError):
         _LOGGER.warning("Unable to process data for %s", fund)
         return None
 
+
+async def async_add_history(history: HistoryStore, fund: str, data: dict):
+    """Add the price of a fund to its history."""
+    day = parse_date(data["attr"]["Dato"])
+    price = to_float(data["state"])
+    if day is None or price is None:
+        return
+    await history.async_add(fund, day, price)
+
+
+class EuronextCoordinator(FundCoordinator):
+    """Refresh all funds of a platform together, with bounded concurrency."""
+
+    def __init__(
+        self,
+        hass,
+        funds: list,
+        parallel_requests: int,
+        update_interval: datetime.timedelta,
+        cache: ResponseCache,
+        pool: ParsePool,
+        store: FundStore,
+        history: HistoryStore,
+        metrics: Metrics,
+        source: EuronextSource = SOURCE,
+    ):
+        super().__init__(
+            hass,
+            _LOGGER,
+            DOMAIN,
+            funds,
+            update_interval,
+            store=store,
+            history=history,
+            metrics=metrics,
+        )
+        self.engine = async_get_engine(hass)
+        self.source = source
+        self.cache = cache
+        self.pool = pool
+        self._semaphore = asyncio.Semaphore(parallel_requests)
+
+    def nav(self, data: dict) -> str:
+        """Return the price of a fund."""
+        return data["state"]
+
+    def nav_date(self, data: dict) -> str:
+        """Return the date of the price of a fund."""
+        return data["attr"]["Dato"]
+
+    async def _async_fetch(self, fund: str) -> dict:
+        """Fetch a single fund, bounded by the semaphore."""
+        async with self._semaphore:
+            return await async_get_process_data(
+                self.engine, fund, self.cache, self.pool, self.metrics, self.source
+            )
+
+    async def _async_update_data(self) -> dict:
+        """Refresh all funds on trading days, and stale funds at any time."""
+        if is_open(dt_util.now(), MARKET_OPENS, MARKET_CLOSES):
+            funds = self.funds
+        else:
+            funds = [fund for fund in self.funds if fund in self.stale]
+        if not funds:
+            return self.data
+        data = await self.async_fetch_all(funds)
+        if not data:
+            raise UpdateFailed("No data received from Euronext")
+        return data
+
+
+class IntradayWatcher:
+    """Poll the prices of a few instruments every few seconds during trading."""
+
+    def __init__(
+        self,
+        hass,
+        sensors: dict,
+        interval: datetime.timedelta,
+        tick: float,
+        parallel_requests: int,
+        metrics: Metrics,
+    ):
+        self.hass = hass
+        self.sensors = sensors
+        self.interval = interval
+        self.tick = tick
+        self.metrics = metrics
+        self.polls = 0
+        self.writes = 0
+        self._semaphore = asyncio.Semaphore(parallel_requests)
+        self._polling = False
+        self._remove = None
+
+    @callback
+    def async_start(self):
+        """Start polling, until Home Assistant stops."""
+        self._remove = async_track_time_interval(
+            self.hass, self._async_poll, self.interval
+        )
+        self.hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self.async_stop)
+
+    @callback
+    def async_stop(self, *_):
+        """Stop polling."""
+        if self._remove is not None:
+            self._remove()
+            self._remove = None
+
+    async def _async_price(self, fund: str) -> str:
+        """Fetch the price of an instrument, or None."""
+        stats = self.metrics.fund(fund, SOURCE.name)
+        engine = async_get_engine(self.hass)
+        start = time.perf_counter()
+        async with self._semaphore:
+            try:
+                # Read whole quotes, a cut stream would close the keep-alive connection
+                status, _, body = await engine.async_request(
+                    SOURCE.method,
+                    SOURCE.url(fund),
+                    timeout=INTRADAY_TIMEOUT,
+                    **SOURCE.request(fund),
+                )
+            except (asyncio.TimeoutError, aiohttp.ClientError) as err:
+                _LOGGER.debug("Unable to fetch the price of %s", fund)
+                stats.failed(isinstance(err, asyncio.TimeoutError))
+                return None
+        stats.fetched(time.perf_counter() - start, len(body.encode()))
+        match = PRICE.search(body) if status == 200 else None
+        if match is None:
+            stats.failed()
+            return None
+        return match.group(1).replace(",", "").strip()
+
+    async def _async_poll(self, now):
+        """Write the prices that moved at least a tick since the state shown."""
+        if self._polling or not is_open(now, INTRADAY_OPENS, INTRADAY_CLOSES):
+            return
+        self._polling = True
+        try:
+            funds = list(self.sensors)
+            prices = await asyncio.gather(
+                *(self._async_price(fund) for fund in funds), return_exceptions=True
+            )
+        finally:
+            self._polling = False
+        self.polls += 1
+        for fund, price in zip(funds, prices):
+            if isinstance(price, Exception):
+                _LOGGER.error("Unexpected error polling %s", fund, exc_info=price)
+                continue
+            sensor = self.sensors[fund]
+            value, shown = to_float(price), to_float(sensor.state)
+            if value is None or sensor.hass is None:
+                continue
+            if shown is not None and (
+                value == shown or abs(value - shown) < self.tick
+            ):
+                continue
+            self.writes += 1
+            sensor.async_set_price(price)
+        _LOGGER.debug(
+            "Intraday poll %s, %s state writes so far", self.polls, self.writes
+        )
+
+
+async def _async_setup_bulk(
+    hass,
+    config,
+    async_add_entities,
+    cache: ResponseCache,
+    pool: ParsePool,
+    store: FundStore,
+    history: HistoryStore,
+    metrics: Metrics,
+    source: EuronextSource,
+):
+    """Set up sensors refreshed together by one coordinator, returned by fund."""
+    coordinator = EuronextCoordinator(
+        hass,
+        config[CONF_FUNDS],
+        config[CONF_PARALLEL_REQUESTS],
+        config[CONF_SCAN_INTERVAL],
+        cache,
+        pool,
+        store,
+        history,
+        metrics,
+        source,
+    )
+    coordinator.data = await coordinator.async_load_stored()
+    missing = [fund for fund in coordinator.funds if fund not in coordinator.data]
+    if missing:
+        coordinator.data = await coordinator.async_fetch_all(missing)
+    for fund in missing:
+        if fund not in coordinator.data:
+            _LOGGER.error("Failed to setup %s", fund)
+    coordinator.funds = [fund for fund in coordinator.funds if fund in coordinator.data]
+    currency = config.get(CONF_CURRENCY)
+    sensors = {
+        fund: EuronextBulkSensor(
+            coordinator,
+            fund,
+            currency or coordinator.data[fund]["unit"],
+            config[CONF_NUMERIC],
+        )
+        for fund in coordinator.funds
+    }
+    async_add_entities(list(sensors.values()))
+    if config[CONF_DIAGNOSTICS]:
+        async_add_entities(metrics.fund_sensors(DOMAIN, coordinator.funds))
+    if coordinator.stale:
+        # Refresh data restored from disk in the background
+        hass.async_create_task(coordinator.async_refresh())
+    _LOGGER.info("Setup of %s funds complete", len(coordinator.funds))
+    return sensors
+
+
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     _LOGGER.debug("Setting up sensors")
-    session = async_get_clientsession(hass)
+    engine = async_get_engine(hass)
     funds = config.get(CONF_FUNDS, [])
     currency = config.get(CONF_CURRENCY)
-    for fund in funds:
-        data = await async_get_process_data(session, fund)
-        if not data:
-            _LOGGER.error("Failed to setup %s", fund)
-            continue
-        unit = currency or data["unit"]
-        async_add_entities([EuronextLiteSensor(data, fund, unit)])
-        _LOGGER.info("Setup of %s complete", data["name"])
+    cache = ResponseCache()
+    pool = ParsePool(config[CONF_PARSE_WORKERS], DOMAIN)
+    source = EuronextSource(streaming=config[CONF_STREAMING])
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, pool.shutdown)
+    store = async_get_store(hass, DOMAIN)
+    await store.async_load()
+    history = async_get_history(hass, DOMAIN)
+    metrics = async_get_metrics(hass, DOMAIN)
+    if config[CONF_DIAGNOSTICS]:
+        hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP, metrics.async_measure_writes(hass, DOMAIN)
+        )
+    async_register_get_history(hass, DOMAIN, history)
+    sensors = {}
+    if config[CONF_BULK]:
+        sensors = await _async_setup_bulk(
+            hass,
+            config,
+            async_add_entities,
+            cache,
+            pool,
+            store,
+            history,
+            metrics,
+            source,
+        )
+    else:
+        for fund in funds:
+            data, fetched = store.get(fund)
+            if not data:
+                data = await async_get_process_data(
+                    engine, fund, cache, pool, metrics, source
+                )
+                if not data:
+                    _LOGGER.error("Failed to setup %s", fund)
+                    continue
+                fetched = None
+                store.async_update(fund, data, dt_util.utcnow())
+                metrics.success(fund, data["state"], dt_util.utcnow())
+                await async_add_history(history, fund, data)
+            unit = currency or data["unit"]
+            sensor = EuronextLiteSensor(
+                data,
+                fund,
+                unit,
+                cache,
+                pool,
+                store,
+                history,
+                metrics,
+                fetched,
+                config[CONF_NUMERIC],
+                source,
+            )
+            sensors[fund] = sensor
+            async_add_entities([sensor])
+            if config[CONF_DIAGNOSTICS]:
+                async_add_entities(metrics.fund_sensors(DOMAIN, [fund]))
+            _LOGGER.info("Setup of %s complete", data["name"])
+    if config[CONF_INTRADAY]:
+        watched = {
+            fund: sensors[fund] for fund in config[CONF_INTRADAY] if fund in sensors
+        }
+        for fund in set(config[CONF_INTRADAY]) - set(watched):
+            _LOGGER.warning("%s is not one of the funds set up, not watching it", fund)
+        if watched:
+            IntradayWatcher(
+                hass,
+                watched,
+                config[CONF_INTRADAY_INTERVAL],
+                config[CONF_TICK],
+                config[CONF_PARALLEL_REQUESTS],
+                metrics,
+            ).async_start()
+    if config[CONF_DIAGNOSTICS]:
+        async_add_entities(metrics.source_sensors(DOMAIN, [SOURCE.name], SOURCE.name))
 
 
-class EuronextLiteSensor(Entity):
+class EuronextSensor(Entity):
     """Representation of the sensor."""
 
-    def __init__(self, data: dict, fund: str, unit: str):
-        self._attr = data["attr"]
-        self._icon = data["icon"]
-        self._name = data["name"]
-        self._state = data["state"]
-        self._unique = data["unique"]
+    # The same for every state, no need to store them with each one
+    _unrecorded_attributes = frozenset((ATTR_ATTRIBUTION, "URL"))
+
+    def __init__(
+        self,
+        data: dict,
+        fund: str,
+        unit: str,
+        fetched: datetime.datetime = None,
+        numeric: bool = False,
+    ):
+        self._fetched = fetched
+        self._numeric = numeric
         self._fund = fund
         self._unit = unit
+        self._set_data(data)
+
+    def _set_data(self, data: dict):
+        """Copy the processed data to the sensor."""
+        self._name = data["name"]
+        self._unique = data["unique"]
+        self._icon = data["icon"]
+        if self._numeric:
+            self._state = to_float(data["state"])
+            self._attr = numeric_attributes(data["attr"])
+        else:
+            self._state = data["state"]
+            self._attr = data["attr"]
+        self._data = data
 
     @property
     def name(self):
@@ -132,20 +546,105 @@ class EuronextLiteSensor(Entity):
 
     @property
     def extra_state_attributes(self):
-        return self._attr
+        if self._fetched is None:
+            return self._attr
+        return {**self._attr, "stale": True, "fetched": self._fetched.isoformat()}
+
+    @callback
+    def async_set_price(self, price: str):
+        """Show an intraday price until the next refresh of the quote."""
+        self._state = to_float(price) if self._numeric else price
+        self.async_write_ha_state()
+
+
+class EuronextLiteSensor(EuronextSensor):
+    """A fund polled on its own."""
+
+    def __init__(
+        self,
+        data: dict,
+        fund: str,
+        unit: str,
+        cache: ResponseCache,
+        pool: ParsePool,
+        store: FundStore,
+        history: HistoryStore,
+        metrics: Metrics,
+        fetched: datetime.datetime = None,
+        numeric: bool = False,
+        source: EuronextSource = SOURCE,
+    ):
+        super().__init__(data, fund, unit, fetched, numeric)
+        self._source = source
+        self._cache = cache
+        self._pool = pool
+        self._store = store
+        self._history = history
+        self._metrics = metrics
+        self._last_fetched = fetched or dt_util.utcnow()
+
+    async def async_added_to_hass(self):
+        """Refresh data restored from disk in the background."""
+        if self._fetched is not None:
+            self.async_schedule_update_ha_state(True)
 
     async def async_update(self):
-        """Update the sensor if weekday between 8:00-23:00."""
-        session = async_get_clientsession(self.hass)
-        now = datetime.datetime.now()
-        if now.weekday() < 5 and 8 <= now.hour < 23:
-            data = await async_get_process_data(session, self._fund)
-            try:
-                self._name = data["name"]
-                self._unique = data["unique"]
-                self._state = data["state"]
-                self._icon = data["icon"]
-                self._attr = data["attr"]
-                _LOGGER.info("Update of %s complete", self._name)
-            except TypeError:
+        """Update the sensor on trading days between 8:00-23:00 Oslo time."""
+        stale = self._fetched is not None
+        if stale or is_open(dt_util.now(), MARKET_OPENS, MARKET_CLOSES):
+            data = await async_get_process_data(
+                async_get_engine(self.hass),
+                self._fund,
+                self._cache,
+                self._pool,
+                self._metrics,
+                self._source,
+            )
+            if data is None:
+                self._fetched = self._fetched or self._last_fetched
                 _LOGGER.warning("Update failed")
+                return
+            self._last_fetched = dt_util.utcnow()
+            self._metrics.success(self._fund, data["state"], self._last_fetched)
+            if data == self._data and self._fetched is None:
+                # Home Assistant drops the identical state instead of recording it
+                self._cache.writes_skipped += 1
+                return
+            self._set_data(data)
+            self._fetched = None
+            self._store.async_update(self._fund, data, self._last_fetched)
+            await async_add_history(self._history, self._fund, data)
+            _LOGGER.info("Update of %s complete", self._name)
+
+
+class EuronextBulkSensor(CoordinatorEntity, EuronextSensor):
+    """A fund refreshed by the coordinator together with the others."""
+
+    def __init__(
+        self,
+        coordinator: EuronextCoordinator,
+        fund: str,
+        unit: str,
+        numeric: bool = False,
+    ):
+        CoordinatorEntity.__init__(self, coordinator)
+        EuronextSensor.__init__(
+            self,
+            coordinator.data[fund],
+            fund,
+            unit,
+            coordinator.stale.get(fund),
+            numeric,
+        )
+
+    @callback
+    def _handle_coordinator_update(self):
+        """Update the sensor from the coordinator, unless nothing changed."""
+        data = self.coordinator.data.get(self._fund)
+        stale = self.coordinator.stale.get(self._fund)
+        if data is self._data and stale == self._fetched:
+            self.coordinator.cache.writes_skipped += 1
+            return
+        self._fetched = stale
+        self._set_data(data)
+        self.async_write_ha_state()
@@ -0,0 +1 @@
+"""fund_consensus sensor."""
@@ -0,0 +1,279 @@
+"""One fund sensor from several sources, falling back between them."""
+import asyncio
+from datetime import date, timedelta
+import logging
+import time
+
+import voluptuous as vol
+
+import homeassistant.helpers.config_validation as cv
+from homeassistant.components.sensor import PLATFORM_SCHEMA
+from homeassistant.const import (
+    ATTR_ATTRIBUTION,
+    ATTR_FRIENDLY_NAME,
+    ATTR_ICON,
+    ATTR_UNIT_OF_MEASUREMENT,
+    CONF_NAME,
+    CONF_SCAN_INTERVAL,
+    STATE_UNAVAILABLE,
+    STATE_UNKNOWN,
+)
+from homeassistant.core import callback
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.entity_component import async_update_entity
+from homeassistant.helpers.event import async_track_state_change_event
+import homeassistant.util.dt as dt_util
+
+from ..fund_engine.market import PublishSchedule, parse_date
+
+_LOGGER = logging.getLogger(__name__)
+
+CONF_FUNDS = "funds"
+CONF_SOURCES = "sources"
+SCAN_INTERVAL = timedelta(minutes=30)
+# Time a source gets to refresh before the next one is tried
+SOURCE_TIMEOUT = 30
+# Weight of the latest refresh in the average latency of a source
+LATENCY_WEIGHT = 0.3
+# Attributes of a source that are not copied to the fund
+OWN_ATTRIBUTES = (ATTR_FRIENDLY_NAME, ATTR_ICON, ATTR_UNIT_OF_MEASUREMENT)
+
+FUND_SCHEMA = vol.Schema(
+    {
+        vol.Required(CONF_NAME): cv.string,
+        vol.Required(CONF_SOURCES): vol.All(
+            cv.ensure_list, [cv.entity_id], vol.Length(min=1)
+        ),
+    }
+)
+
+PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
+    {vol.Required(CONF_FUNDS): vol.All(cv.ensure_list, [FUND_SCHEMA])}
+)
+
+
+def _usable(state) -> bool:
+    """Return True if a source state holds a value."""
+    return state is not None and state.state not in (STATE_UNAVAILABLE, STATE_UNKNOWN)
+
+
+def _nav_date(state):
+    """Return the NAV date of a usable source state, or None without a Dato."""
+    return parse_date(state.attributes.get("Dato"))
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """Set up one sensor per fund."""
+    scan_interval = config.get(CONF_SCAN_INTERVAL, SCAN_INTERVAL)
+    async_add_entities(
+        [
+            FundConsensusSensor(fund[CONF_NAME], fund[CONF_SOURCES], scan_interval)
+            for fund in config[CONF_FUNDS]
+        ]
+    )
+
+
+class SourceStats:
+    """Success rate and latency of the refreshes of one source."""
+
+    __slots__ = ("attempts", "successes", "latency")
+
+    def __init__(self):
+        self.attempts = 0
+        self.successes = 0
+        self.latency = None
+
+    def record(self, seconds: float, success: bool):
+        """Record a refresh and how long it took."""
+        self.attempts += 1
+        self.successes += success
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_WEIGHT * (seconds - self.latency)
+
+    @property
+    def success_rate(self) -> float:
+        """Return the share of good refreshes, starting out at one half."""
+        return (self.successes + 1) / (self.attempts + 2)
+
+
+class FundConsensusSensor(Entity):
+    """The freshest NAV of a fund among the sensors of several sources."""
+
+    _unrecorded_attributes = frozenset((ATTR_ATTRIBUTION, "URL"))
+
+    def __init__(self, name: str, sources: list, scan_interval: timedelta):
+        self._name = name
+        self._sources = sources
+        self._stats = {source: SourceStats() for source in sources}
+        self._schedule = PublishSchedule(scan_interval)
+        self._next_refresh = None
+        self._source = None
+        self._state = None
+        self._unit = None
+        self._icon = None
+        self._attr = None
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return self._name
+
+    @property
+    def state(self):
+        """Return the NAV of the selected source."""
+        return self._state
+
+    @property
+    def unit_of_measurement(self):
+        """Return the currency of the selected source."""
+        return self._unit
+
+    @property
+    def icon(self):
+        """Return the icon of the selected source."""
+        return self._icon
+
+    @property
+    def available(self):
+        """Return True while any source has a value."""
+        return self._source is not None
+
+    @property
+    def extra_state_attributes(self):
+        """Return the attributes of the selected source and the source order."""
+        return self._attr
+
+    async def async_added_to_hass(self):
+        """Read the current source states and follow their changes."""
+        self._select()
+        self.async_on_remove(
+            async_track_state_change_event(
+                self.hass, self._sources, self._async_source_changed
+            )
+        )
+
+    @callback
+    def _async_source_changed(self, event):
+        """Select again when a source changed, writing only if the fund changed."""
+        if self._select():
+            self.async_write_ha_state()
+
+    def _ranked(self) -> list:
+        """Return the sources by success rate, then latency, then configured order.
+
+        Sources that were never refreshed have no latency yet and are tried
+        early, so that every source gets measured.
+        """
+        return sorted(
+            self._sources,
+            key=lambda source: (
+                -round(self._stats[source].success_rate, 1),
+                self._stats[source].latency or 0,
+                self._sources.index(source),
+            ),
+        )
+
+    def _freshest(self):
+        """Return the latest NAV date among the sources, or None."""
+        dates = [
+            _nav_date(state)
+            for state in map(self.hass.states.get, self._sources)
+            if _usable(state)
+        ]
+        return max(filter(None, dates), default=None)
+
+    async def _async_refresh(self, source: str) -> bool:
+        """Refresh a source, returning False if it could not be refreshed."""
+        try:
+            await async_update_entity(self.hass, source)
+        except HomeAssistantError as error:
+            _LOGGER.warning("Could not refresh %s: %s", source, error)
+            return False
+        return True
+
+    async def async_update(self):
+        """Refresh the sources when a new NAV may be out, and select again.
+
+        Refreshing a source refreshes every fund of its coordinator, so it
+        waits for the publish time learned from the NAV dates, skipping
+        weekends and holidays. Until then the sensor follows the updates the
+        sources make on their own.
+        """
+        if self._next_refresh is None or dt_util.now() >= self._next_refresh:
+            await self._async_refresh_sources()
+        now = dt_util.now()
+        self._schedule.observe(self._name, self._freshest(), now)
+        self._next_refresh = now + self._schedule.next_interval(now, [self._name])
+        _LOGGER.debug(
+            "Next refresh of the sources of %s at %s", self._name, self._next_refresh
+        )
+        self._select()
+
+    async def _async_refresh_sources(self):
+        """Refresh the sources in rank order until one has the freshest NAV."""
+        freshest = self._freshest()
+        for source in self._ranked():
+            start = time.monotonic()
+            task = self.hass.async_create_task(self._async_refresh(source))
+            # A slow source keeps refreshing in the background while the next is tried
+            done, _ = await asyncio.wait((task,), timeout=SOURCE_TIMEOUT)
+            state = self.hass.states.get(source)
+            success = (
+                task in done
+                and task.result()
+                and _usable(state)
+                and not state.attributes.get("stale")
+                and (freshest is None or (_nav_date(state) or freshest) >= freshest)
+            )
+            self._stats[source].record(time.monotonic() - start, success)
+            if success:
+                break
+            _LOGGER.debug("No fresh NAV for %s from %s", self._name, source)
+        _LOGGER.debug(
+            "Sources of %s: %s",
+            self._name,
+            {
+                source: (round(stats.success_rate, 2), stats.latency)
+                for source, stats in self._stats.items()
+            },
+        )
+
+    def _select(self) -> bool:
+        """Select the source with the freshest NAV, returning True on change.
+
+        Ties go to fresh data over stale data, then to the higher ranked source.
+        """
+        ranked = self._ranked()
+        best, best_key = None, None
+        for rank, source in enumerate(ranked):
+            state = self.hass.states.get(source)
+            if not _usable(state):
+                continue
+            key = (
+                _nav_date(state) or date.min,
+                not state.attributes.get("stale"),
+                -rank,
+            )
+            if best_key is None or key > best_key:
+                best, best_key = state, key
+        if best is None:
+            changed = self._source is not None
+            self._source = self._state = self._unit = self._icon = self._attr = None
+            return changed
+        attr = {
+            key: value
+            for key, value in best.attributes.items()
+            if key not in OWN_ATTRIBUTES
+        }
+        attr["source"] = best.entity_id
+        attr["sources"] = ranked
+        unit = best.attributes.get(ATTR_UNIT_OF_MEASUREMENT)
+        current = (best.state, unit, best.attributes.get(ATTR_ICON), attr)
+        if current == (self._state, self._unit, self._icon, self._attr):
+            return False
+        self._source = best.entity_id
+        self._state, self._unit, self._icon, self._attr = current
+        return True
@@ -0,0 +1,10 @@
+"""Fetching, parsing and storage shared by the fund integrations."""
+import homeassistant.helpers.config_validation as cv
+
+DOMAIN = "fund_engine"
+CONFIG_SCHEMA = cv.empty_config_schema(DOMAIN)
+
+
+async def async_setup(hass, config) -> bool:
+    """Set up nothing, the fund integrations create what they use on demand."""
+    return True
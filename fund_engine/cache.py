@@ -0,0 +1,66 @@
+"""Per-fund response cache for conditional requests."""
+import hashlib
+
+from aiohttp import hdrs
+
+
+def _digest(body: str) -> bytes:
+    """Return a short hash of the response body."""
+    return hashlib.blake2b(body.encode(), digest_size=16).digest()
+
+
+class CachedResponse:
+    """Validators, body hash and parsed data of the last good response."""
+
+    __slots__ = ("etag", "last_modified", "digest", "data")
+
+    def __init__(self, etag, last_modified, digest, data):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.data = data
+
+
+class ResponseCache:
+    """Skip parsing and state writes when a fund page hasn't changed."""
+
+    def __init__(self):
+        self._entries = {}
+        self.parses = 0
+        self.parses_skipped = 0
+        self.writes_skipped = 0
+
+    def request_headers(self, url: str) -> dict:
+        """Return conditional request headers for the url, if any."""
+        entry = self._entries.get(url)
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers[hdrs.IF_NONE_MATCH] = entry.etag
+            if entry.last_modified:
+                headers[hdrs.IF_MODIFIED_SINCE] = entry.last_modified
+        return headers
+
+    def not_modified(self, url: str) -> dict:
+        """Return the cached data after a 304 Not Modified response."""
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        self.parses_skipped += 1
+        return entry.data
+
+    def unchanged(self, url: str, body: str) -> dict:
+        """Return the cached data if the body is identical to the last one."""
+        entry = self._entries.get(url)
+        if entry is None or entry.digest != _digest(body):
+            return None
+        self.parses_skipped += 1
+        return entry.data
+
+    def store(self, url: str, headers, body: str, data: dict):
+        """Remember a freshly parsed response."""
+        self.parses += 1
+        if data:
+            self._entries[url] = CachedResponse(
+                headers.get(hdrs.ETAG), headers.get(hdrs.LAST_MODIFIED), _digest(body), data
+            )
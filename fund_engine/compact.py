@@ -0,0 +1,18 @@
+"""Share the strings that repeat across funds, to keep long fund lists small."""
+import sys
+
+
+def compact(value):
+    """Return the value with the keys and strings of nested dicts and lists interned.
+
+    Every parsed page and every fund loaded from the store comes with its own
+    copies of the attribute names, the attribution, the icon, the currency and
+    the NAV date. Interned, each of them is kept once for all funds.
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {sys.intern(key): compact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [compact(item) for item in value]
+    return value
@@ -0,0 +1,180 @@
+"""Coordinator of the funds of a platform, serving the last good data of each."""
+import asyncio
+from datetime import timedelta
+
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+import homeassistant.util.dt as dt_util
+
+from .history import HistoryStore
+from .market import PublishSchedule, parse_date
+from .metrics import Metrics
+from .numeric import to_float
+from .store import FundStore
+
+
+class FundCoordinator(DataUpdateCoordinator):
+    """Refresh funds together, keeping the last good data of those that fail.
+
+    data maps the key of each fund to its data, and stale maps the keys of
+    funds whose data couldn't be refreshed to when it was last fetched. The
+    data starts out from the store, so sensors have a state right away.
+
+    Subclasses return the key of a fund, and the NAV and its date in the
+    data. To refresh one fund at a time they implement _async_fetch, or else
+    override async_fetch_all.
+    """
+
+    def __init__(
+        self,
+        hass,
+        logger,
+        name: str,
+        funds: list,
+        update_interval: timedelta,
+        adaptive: bool = False,
+        store: FundStore = None,
+        history: HistoryStore = None,
+        metrics: Metrics = None,
+    ):
+        super().__init__(hass, logger, name=name, update_interval=update_interval)
+        self.funds = funds
+        self.store = store
+        self.history = history
+        self.metrics = metrics
+        self.stale = {}
+        self.fetched = {}
+        self.schedule = PublishSchedule(update_interval) if adaptive else None
+
+    def key(self, fund) -> str:
+        """Return the key of a fund in the data."""
+        return fund
+
+    def nav(self, data: dict):
+        """Return the NAV in the data of a fund."""
+        raise NotImplementedError
+
+    def nav_date(self, data: dict) -> str:
+        """Return the date of the NAV in the data of a fund."""
+        raise NotImplementedError
+
+    async def _async_fetch(self, fund) -> dict:
+        """Fetch a fund, returning its data or None."""
+        raise NotImplementedError
+
+    async def async_load_stored(self, funds: list = None) -> dict:
+        """Return the stored data of the funds, marked as stale."""
+        data = {}
+        if self.store is None:
+            return data
+        await self.store.async_load()
+        for fund in self.funds if funds is None else funds:
+            key = self.key(fund)
+            stored, fetched = self.store.get(key)
+            if stored:
+                data[key] = stored
+                self.stale[key] = fetched
+        return data
+
+    async def async_fetch_each(self, funds: list, timeout: float = None) -> dict:
+        """Fetch funds concurrently, returning their data by key, None if they failed.
+
+        A fund that fails unexpectedly, or isn't done within timeout, fails
+        alone.
+        """
+        tasks = {
+            self.key(fund): asyncio.ensure_future(self._async_fetch(fund))
+            for fund in funds
+        }
+        if not tasks:
+            return {}
+        _, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        results = {}
+        for key, task in tasks.items():
+            results[key] = None
+            if task.cancelled():
+                continue
+            if task.exception() is not None:
+                self.logger.error(
+                    "Unexpected error updating %s", key, exc_info=task.exception()
+                )
+                continue
+            results[key] = task.result()
+        return results
+
+    async def async_merge(self, data: dict, results: dict):
+        """Merge fetched results by key into data.
+
+        Results equal to the data sensors have are replaced by it, so they skip
+        the state write. New data is saved to the store and its NAV added to
+        the history. Funds that failed keep their data, marked as stale.
+        """
+        now = dt_util.utcnow()
+        for key, result in results.items():
+            if not result:
+                self.logger.warning("Failed to update %s", key)
+                if key in data:
+                    self.stale.setdefault(key, self.fetched.get(key, now))
+                continue
+            if result == data.get(key):
+                result = data[key]
+            else:
+                await self._async_store(key, result, now)
+            data[key] = result
+            self.fetched[key] = now
+            self.stale.pop(key, None)
+            if self.metrics is not None:
+                self.metrics.success(key, self.nav(result), now)
+
+    async def _async_store(self, key: str, data: dict, now):
+        """Save fresh data for a fund and add its NAV to the history."""
+        if self.store is not None:
+            self.store.async_update(key, data, now)
+        if self.history is None:
+            return
+        day = parse_date(self.nav_date(data))
+        nav = to_float(self.nav(data))
+        if day is not None and nav is not None:
+            await self.history.async_add(key, day, nav)
+
+    async def async_fetch_all(self, funds: list = None, timeout: float = None) -> dict:
+        """Fetch the funds, all of them by default, and return the merged data."""
+        data = dict(self.data or {})
+        results = await self.async_fetch_each(
+            self.funds if funds is None else funds, timeout
+        )
+        await self.async_merge(data, results)
+        self._plan_next_refresh(data)
+        return data
+
+    def _plan_next_refresh(self, data: dict):
+        """Schedule the next refresh around the expected NAV publish time."""
+        if self.schedule is None:
+            return
+        now = dt_util.now()
+        for key, fund_data in data.items():
+            self.schedule.observe(key, parse_date(self.nav_date(fund_data)), now)
+        self.update_interval = self.schedule.next_interval(
+            now, [self.key(fund) for fund in self.funds]
+        )
+        self.logger.debug("Next refresh in %s", self.update_interval)
+
+    async def async_start(self, timeout: float = None):
+        """Load the stored data and fetch the funds without any.
+
+        Stored data is refreshed in the background, so setup doesn't wait for
+        the providers.
+        """
+        data = self.data = await self.async_load_stored()
+        missing = [fund for fund in self.funds if self.key(fund) not in data]
+        if missing:
+            data = await self.async_fetch_all(missing, timeout)
+        self.async_set_updated_data(data)
+        for key in map(self.key, missing):
+            if key not in data:
+                self.logger.warning(
+                    "No data for %s during setup, will retry on update", key
+                )
+        if self.stale:
+            self.hass.async_create_task(self.async_refresh())
@@ -0,0 +1,542 @@
+"""Request scheduling, parsing and caching shared by the fund integrations."""
+import asyncio
+import codecs
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import partial
+import logging
+import random
+import re
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+import async_timeout
+
+from homeassistant.core import callback
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+import homeassistant.util.dt as dt_util
+
+from .cache import ResponseCache
+from .metrics import FundMetrics, Metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_ENGINE = "fund_engine"
+DEFAULT_TIMEOUT = 10
+# Concurrent requests per host, across every integration using the engine
+HOST_LIMIT = 6
+# Seconds a fetched fund is reused by other callers, well below any scan interval
+RESULT_TTL = 30
+# Retries after a failed request, waiting BACKOFF * 2 ** attempt seconds with jitter
+RETRIES = 2
+BACKOFF = 1.0
+# Longest wait before a retry, hosts asking for longer are given a break instead
+MAX_BACKOFF = 30.0
+# Consecutive failures before requests to a host fail fast, and for how long
+BREAKER_THRESHOLD = 5
+BREAKER_TIMEOUT = 300.0
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# Seconds between the ticks that measure how late the event loop runs
+LAG_INTERVAL = 0.005
+# Bytes read at a time from a streamed response
+CHUNK_SIZE = 16384
+# Charset declared in the page, for responses without one in the Content-Type,
+# looked for in the first CHARSET_HEAD bytes as browsers do
+CHARSET_HEAD = 1024
+META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w.:-]+)""", re.IGNORECASE)
+
+
+def trend_icon(change: float) -> str:
+    """Return the icon for a positive, negative or unchanged return."""
+    if change > 0:
+        return "mdi:trending-up"
+    if change < 0:
+        return "mdi:trending-down"
+    return "mdi:trending-neutral"
+
+
+class HostUnavailable(aiohttp.ClientError):
+    """Raised without sending a request while a host's circuit is open."""
+
+
+def _retry_after(value: str) -> float:
+    """Return the seconds to wait from a Retry-After header, or None."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - dt_util.utcnow()).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class Breaker:
+    """Failure count and open state of the circuit to one host."""
+
+    __slots__ = ("failures", "open_until")
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        """Return True while requests to the host should fail fast."""
+        return time.monotonic() < self.open_until
+
+    def success(self):
+        """Close the circuit after a good response."""
+        self.failures = 0
+        self.open_until = 0.0
+
+    def failure(self, wait: float = None):
+        """Count a failed request, opening the circuit if the host is down."""
+        self.failures += 1
+        if wait is None and self.failures >= BREAKER_THRESHOLD:
+            wait = BREAKER_TIMEOUT
+        if wait is not None:
+            self.open_until = max(self.open_until, time.monotonic() + wait)
+
+
+class StreamEnd:
+    """Where the page sections a parser needs end, to stop reading after them.
+
+    Each section is a start marker and the end marker that closes it. The body
+    is cut right after the last section, so the same page always gives the same
+    body for the response cache.
+    """
+
+    def __init__(self, *sections: tuple):
+        self.sections = sections
+        # A marker may be split between what was searched and what arrived since
+        self.overlap = max(len(marker) for section in sections for marker in section)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, StreamEnd) and self.sections == other.sections
+
+    def __hash__(self) -> int:
+        return hash(self.sections)
+
+    def find(self, text: str, found: list = None, searched: int = 0) -> int:
+        """Return where the last section ends, or None until all have ended.
+
+        To search a growing text again, pass the same found list every time,
+        with the length of the text at the last search as searched. Markers
+        found before are kept, and the others are only looked for in the new
+        text.
+        """
+        if found is None:
+            found = [(-1, -1)] * len(self.sections)
+        since = max(0, searched - self.overlap)
+        end = 0
+        for index, (start_marker, end_marker) in enumerate(self.sections):
+            start, stop = found[index]
+            if start < 0:
+                start = text.find(start_marker, since)
+            if start >= 0 and stop < 0:
+                stop = text.find(end_marker, max(since, start + len(start_marker)))
+            found[index] = start, stop
+            if end is not None:
+                end = max(end, stop + len(end_marker)) if stop >= 0 else None
+        return end
+
+
+def _charset(response: aiohttp.ClientResponse, head: bytes) -> str:
+    """Return the charset of a response, from its headers or its first bytes.
+
+    Unlike response.get_encoding(), this works before the body is read, and
+    falls back to UTF-8.
+    """
+    charset = response.charset
+    if charset is None:
+        match = META_CHARSET.search(head)
+        charset = match and match.group(1).decode("ascii")
+    try:
+        return codecs.lookup(charset or "utf-8").name
+    except LookupError:
+        return "utf-8"
+
+
+def _frozen(value):
+    """Return request arguments as a hashable value, to compare requests."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _frozen(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(map(_frozen, value))
+    return value
+
+
+class StreamReader:
+    """Read a response in chunks until the sections a parser needs have arrived."""
+
+    def __init__(self, stream_end: StreamEnd):
+        self._stream_end = stream_end
+        self.cut = False
+
+    async def __call__(self, response: aiohttp.ClientResponse) -> str:
+        """Return the body up to the end of the last section, or all of it."""
+        self.cut = False
+        if response.status != 200:
+            return await response.text()
+        decoder = None
+        head = b""
+        text = ""
+        found = [(-1, -1)] * len(self._stream_end.sections)
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            if decoder is None:
+                head += chunk
+                if response.charset is None and len(head) < CHARSET_HEAD:
+                    continue
+                decoder = codecs.getincrementaldecoder(_charset(response, head))()
+                chunk = head
+            searched = len(text)
+            text += decoder.decode(chunk)
+            end = self._stream_end.find(text, found, searched)
+            if end is not None:
+                # Closing the connection drops the rest of the page unread
+                response.close()
+                self.cut = True
+                return text[:end]
+        if decoder is None:
+            # A page shorter than CHARSET_HEAD, cut the same way as longer ones
+            text = codecs.decode(head, _charset(response, head))
+            end = self._stream_end.find(text)
+            return text if end is None else text[:end]
+        return text + decoder.decode(b"", final=True)
+
+
+class Source:
+    """How to request and parse the data of a fund from one provider."""
+
+    name = None
+    method = "GET"
+    # Send the validators of the last response, for servers that support them
+    conditional = True
+    # Stop reading responses once these sections have arrived, None reads all
+    stream_end = None
+    # What else decides what parse returns, such as the parser
+    parse_options = ()
+
+    def url(self, fund: str) -> str:
+        """Return the url of a fund."""
+        raise NotImplementedError
+
+    def key(self, fund: str) -> tuple:
+        """Return what identifies a parsed fund, callers with the same key share it.
+
+        Sources of the same class and parse options parse a page alike, even
+        when every platform builds its own.
+        """
+        return type(self), self.parse_options, self.url(fund)
+
+    def request(self, fund: str) -> dict:
+        """Return extra request arguments, such as a body or headers."""
+        return {}
+
+    def parse(self, body: str, fund: str, url: str) -> dict:
+        """Extract the fund data from a response body, in a worker thread."""
+        raise NotImplementedError
+
+
+class LagProbe:
+    """The longest delay of a repeating timer on the event loop, until stopped."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._due = loop.time() + LAG_INTERVAL
+        self._handle = loop.call_at(self._due, self._tick)
+        self.max = 0.0
+
+    def _tick(self):
+        now = self._loop.time()
+        self.max = max(self.max, now - self._due)
+        self._due = now + LAG_INTERVAL
+        self._handle = self._loop.call_at(self._due, self._tick)
+
+    def stop(self) -> float:
+        """Stop the timer and return the longest delay, counting the last tick."""
+        self._handle.cancel()
+        self.max = max(self.max, self._loop.time() - self._due)
+        return self.max
+
+
+class ParsePool:
+    """Parse responses in a bounded worker pool, off the event loop.
+
+    Worker threads still hold the GIL while html.parser runs in Python, which
+    delays the event loop. Worker processes don't, at the cost of sending
+    every body and result between processes.
+    """
+
+    def __init__(self, workers: int, name: str, processes: bool = False):
+        if processes:
+            self.executor = ProcessPoolExecutor(workers)
+        else:
+            self.executor = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        self.loop_lag = 0.0
+        self.parse_time = 0.0
+
+    @staticmethod
+    def _timed(parse, body: str, fund: str, url: str):
+        start = time.perf_counter()
+        return parse(body, fund, url), time.perf_counter() - start
+
+    async def async_parse(self, parse, body: str, fund: str, url: str) -> tuple:
+        """Parse a response in the pool, returning the data and the parse time.
+
+        The longest event loop delay while the parse runs is added to loop_lag.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self._timed, parse, body, fund, url)
+        probe = LagProbe(loop)
+        try:
+            data, parse_time = await future
+        finally:
+            loop_lag = probe.stop()
+        self.loop_lag += loop_lag
+        self.parse_time += parse_time
+        _LOGGER.debug(
+            "Parsed %s in %.1f ms, the event loop lagged up to %.2f ms meanwhile",
+            fund,
+            parse_time * 1000,
+            loop_lag * 1000,
+        )
+        return data, parse_time
+
+    def shutdown(self, *_):
+        """Stop the worker pool."""
+        self.executor.shutdown(wait=False)
+
+
+class FetchEngine:
+    """Schedule the requests of every fund integration over one connection pool."""
+
+    def __init__(self, hass, limit_per_host: int = HOST_LIMIT, session=None):
+        # Home Assistant's shared session keeps connections alive between refreshes
+        self._session = session or async_get_clientsession(hass)
+        self._limit_per_host = limit_per_host
+        self._hosts = {}
+        self._breakers = {}
+        self._inflight = {}
+        self._results = {}
+        self._requests = {}
+        self.requests = 0
+        self.coalesced = 0
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self._limit_per_host)
+        return self._hosts[host]
+
+    def breaker(self, url: str) -> Breaker:
+        """Return the circuit breaker of the url's host."""
+        host = urlsplit(url).netloc
+        if host not in self._breakers:
+            self._breakers[host] = Breaker()
+        return self._breakers[host]
+
+    async def _async_send(
+        self, method: str, url: str, timeout: float, read=None, **kwargs
+    ) -> tuple:
+        async with self._host_limit(url):
+            self.requests += 1
+            async with async_timeout.timeout(timeout):
+                async with self._session.request(method, url, **kwargs) as response:
+                    if read is None:
+                        body = await response.text()
+                    else:
+                        body = await read(response)
+                    return response.status, response.headers, body
+
+    async def async_request(
+        self,
+        method: str,
+        url: str,
+        timeout: float = DEFAULT_TIMEOUT,
+        read=None,
+        **kwargs,
+    ) -> tuple:
+        """Send a request with retries and return the status, headers and body.
+
+        The body is read with read, such as a StreamReader, if given. Timeouts,
+        connection errors, 429 and 5xx responses are retried with jittered
+        exponential backoff, honouring Retry-After. Requests to a host that
+        keeps failing, or asked for a longer break, fail fast with
+        HostUnavailable until the breaker timeout has passed.
+        """
+        breaker = self.breaker(url)
+        for attempt in range(RETRIES + 1):
+            if breaker.is_open:
+                raise HostUnavailable(f"{urlsplit(url).netloc} is unavailable")
+            wait = None
+            try:
+                status, headers, body = await self._async_send(
+                    method, url, timeout, read, **kwargs
+                )
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                if attempt == RETRIES:
+                    breaker.failure()
+                    raise
+            else:
+                if status not in RETRY_STATUSES:
+                    breaker.success()
+                    return status, headers, body
+                wait = _retry_after(headers.get(aiohttp.hdrs.RETRY_AFTER))
+                if attempt == RETRIES or (wait or 0) > MAX_BACKOFF:
+                    breaker.failure(wait)
+                    return status, headers, body
+            backoff = min(BACKOFF * 2 ** attempt, MAX_BACKOFF) * random.uniform(0.5, 1)
+            _LOGGER.debug("Retrying %s in %.1f s", url, max(wait or 0, backoff))
+            await asyncio.sleep(max(wait or 0, backoff))
+
+    async def _async_read(
+        self, method: str, url: str, stream_end: StreamEnd, kwargs: dict
+    ) -> tuple:
+        reader = None if stream_end is None else StreamReader(stream_end)
+        status, headers, body = await self.async_request(
+            method, url, read=reader, **kwargs
+        )
+        return status, headers, body, reader is not None and reader.cut
+
+    async def async_shared_request(
+        self, method: str, url: str, stream_end: StreamEnd = None, **kwargs
+    ) -> tuple:
+        """Send a request, sharing the response with identical requests in flight.
+
+        Returns the status, headers and body, and whether the body was cut
+        after the sections of stream_end. Requests are identical when they
+        have the same method, url, stream_end and arguments, such as the body
+        and the validators of a conditional request.
+        """
+        key = (method, url, stream_end, _frozen(kwargs))
+        future = self._requests.get(key)
+        if future is None:
+            future = asyncio.ensure_future(
+                self._async_read(method, url, stream_end, kwargs)
+            )
+            future.add_done_callback(partial(self._read, key))
+            self._requests[key] = future
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    def _read(self, key: tuple, future: asyncio.Future):
+        """Clear the in-flight request, the waiters have the response."""
+        del self._requests[key]
+        if not future.cancelled():
+            # Retrieved here too, in case every waiter gave up
+            future.exception()
+
+    async def async_fetch(
+        self,
+        source: Source,
+        fund: str,
+        pool: ParsePool,
+        cache: ResponseCache,
+        metrics: Metrics = None,
+    ) -> dict:
+        """Fetch a fund, sharing the result with every caller of the same key."""
+        if metrics is None:
+            stats = FundMetrics(source.name)
+        else:
+            stats = metrics.fund(fund, source.name)
+        key = source.key(fund)
+        result = self._results.get(key)
+        if result is not None and result[0] > time.monotonic():
+            self.coalesced += 1
+            stats.cache_hits += 1
+            return result[1]
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            stats.cache_hits += 1
+        else:
+            future = asyncio.ensure_future(
+                self._async_fetch(source, fund, pool, cache, stats)
+            )
+            future.add_done_callback(partial(self._fetched, key))
+            self._inflight[key] = future
+        # A caller that gives up must not cancel the fetch for the others
+        return await asyncio.shield(future)
+
+    def _fetched(self, key: tuple, future: asyncio.Future):
+        """Keep a good result for RESULT_TTL and clear the in-flight entry."""
+        del self._inflight[key]
+        if not future.cancelled() and future.exception() is None and future.result():
+            self._results[key] = (time.monotonic() + RESULT_TTL, future.result())
+
+    async def _async_fetch(
+        self,
+        source: Source,
+        fund: str,
+        pool: ParsePool,
+        cache: ResponseCache,
+        stats: FundMetrics,
+        stream: bool = True,
+    ) -> dict:
+        """Fetch and parse a fund, unless the response is unchanged.
+
+        Pages of sources with a stream_end are only read until the sections
+        the parser needs have arrived. If the parser can't use a cut page,
+        the whole page is fetched once more.
+        """
+        url = source.url(fund)
+        kwargs = source.request(fund)
+        if source.conditional:
+            kwargs["headers"] = {**kwargs.get("headers", {}), **cache.request_headers(url)}
+        stream_end = source.stream_end if stream else None
+        start = time.perf_counter()
+        try:
+            status, headers, body, cut = await self.async_shared_request(
+                source.method, url, stream_end, **kwargs
+            )
+        except HostUnavailable:
+            _LOGGER.debug("Skipped %s, %s is unavailable", fund, source.name)
+            stats.failed()
+            return None
+        except (asyncio.TimeoutError, aiohttp.ClientError) as err:
+            _LOGGER.warning("Unable to fetch %s from %s", fund, source.name)
+            stats.failed(isinstance(err, asyncio.TimeoutError))
+            return None
+        fetch_time = time.perf_counter() - start
+        stats.fetched(fetch_time, len(body.encode()))
+        _LOGGER.debug(
+            "Response from %s for %s: %s, %d characters in %.0f ms%s",
+            source.name,
+            fund,
+            status,
+            len(body),
+            fetch_time * 1000,
+            ", stopped after the needed sections" if cut else "",
+        )
+        if status == 304:
+            stats.cache_hits += 1
+            return cache.not_modified(url)
+        if status >= 400:
+            _LOGGER.warning("HTTP error %s from %s for %s", status, source.name, fund)
+            stats.failed()
+            return None
+        data = cache.unchanged(url, body)
+        if data is None:
+            data, parse_time = await pool.async_parse(source.parse, body, fund, url)
+            stats.parsed(parse_time)
+            if data is None and cut:
+                _LOGGER.debug("Fetching all of %s from %s", fund, source.name)
+                return await self._async_fetch(source, fund, pool, cache, stats, False)
+            cache.store(url, headers, body, data)
+        else:
+            stats.cache_hits += 1
+        return data
+
+
+@callback
+def async_get_engine(hass) -> FetchEngine:
+    """Return the engine shared by all fund integrations."""
+    if DATA_ENGINE not in hass.data:
+        hass.data[DATA_ENGINE] = FetchEngine(hass)
+    return hass.data[DATA_ENGINE]
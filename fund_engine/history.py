@@ -0,0 +1,159 @@
+"""Compact daily NAV history per fund."""
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from functools import partial
+import logging
+import os
+import re
+import struct
+
+import voluptuous as vol
+
+from homeassistant.core import ServiceCall, SupportsResponse, callback
+import homeassistant.helpers.config_validation as cv
+
+_LOGGER = logging.getLogger(__name__)
+
+ATTR_END = "end"
+ATTR_FUND = "fund"
+ATTR_START = "start"
+HEADER = struct.Struct("<I")
+SERVICE_GET_HISTORY = "get_history"
+
+GET_HISTORY_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_FUND): cv.string,
+        vol.Optional(ATTR_START): cv.date,
+        vol.Optional(ATTR_END): cv.date,
+    }
+)
+
+
+class NavHistory:
+    """Daily NAVs of one fund, stored as date ordinals and prices."""
+
+    __slots__ = ("dates", "navs")
+
+    def __init__(self):
+        self.dates = array("i")
+        self.navs = array("d")
+
+    def append(self, day: date, nav: float) -> bool:
+        """Add an observation, returning True if the history changed."""
+        ordinal = day.toordinal()
+        if self.dates and ordinal < self.dates[-1]:
+            return False
+        if self.dates and ordinal == self.dates[-1]:
+            if self.navs[-1] == nav:
+                return False
+            self.navs[-1] = nav
+            return True
+        self.dates.append(ordinal)
+        self.navs.append(nav)
+        return True
+
+    def range(self, start: date = None, end: date = None) -> list:
+        """Return the (date, nav) observations between start and end, inclusive."""
+        first = bisect_left(self.dates, start.toordinal()) if start else 0
+        last = bisect_right(self.dates, end.toordinal()) if end else len(self.dates)
+        return [
+            (date.fromordinal(self.dates[i]), self.navs[i]) for i in range(first, last)
+        ]
+
+    def to_bytes(self) -> bytes:
+        """Serialize to a count header followed by the two columns."""
+        return HEADER.pack(len(self.dates)) + self.dates.tobytes() + self.navs.tobytes()
+
+    @classmethod
+    def from_bytes(cls, raw: bytes):
+        """Deserialize data written by to_bytes.
+
+        Raises ValueError if the length doesn't match the count, such as for a
+        file cut short by a crash.
+        """
+        history = cls()
+        (count,) = HEADER.unpack_from(raw)
+        split = HEADER.size + count * history.dates.itemsize
+        if len(raw) != split + count * history.navs.itemsize:
+            raise ValueError(f"{len(raw)} bytes don't hold {count} observations")
+        history.dates.frombytes(raw[HEADER.size:split])
+        history.navs.frombytes(raw[split:])
+        return history
+
+
+class HistoryStore:
+    """NAV histories of all funds, one small binary file per fund."""
+
+    def __init__(self, hass, key: str):
+        self._hass = hass
+        self._path = hass.config.path(".storage", f"{key}.history")
+        self._funds = {}
+
+    def _file(self, fund: str) -> str:
+        return os.path.join(self._path, re.sub(r"[^\w.-]", "_", fund) + ".bin")
+
+    def _load(self, fund: str) -> NavHistory:
+        try:
+            with open(self._file(fund), "rb") as history_file:
+                return NavHistory.from_bytes(history_file.read())
+        except FileNotFoundError:
+            return NavHistory()
+        except (OSError, ValueError, struct.error):
+            _LOGGER.warning("Unable to read the NAV history of %s", fund)
+            return NavHistory()
+
+    def _save(self, fund: str, raw: bytes):
+        os.makedirs(self._path, exist_ok=True)
+        temp = self._file(fund) + ".tmp"
+        with open(temp, "wb") as history_file:
+            history_file.write(raw)
+        os.replace(temp, self._file(fund))
+
+    async def async_get(self, fund: str) -> NavHistory:
+        """Return the history of a fund, loading it from disk once."""
+        if fund not in self._funds:
+            self._funds[fund] = await self._hass.async_add_executor_job(self._load, fund)
+        return self._funds[fund]
+
+    async def async_add(self, fund: str, day: date, nav: float):
+        """Add an observation and save the history if it changed."""
+        history = await self.async_get(fund)
+        if history.append(day, nav):
+            await self._hass.async_add_executor_job(self._save, fund, history.to_bytes())
+
+
+async def async_handle_get_history(history: HistoryStore, call: ServiceCall) -> dict:
+    """Return the stored NAVs of a fund between two dates."""
+    fund_history = await history.async_get(call.data[ATTR_FUND])
+    return {
+        "history": [
+            {"date": day.isoformat(), "nav": nav}
+            for day, nav in fund_history.range(
+                call.data.get(ATTR_START), call.data.get(ATTR_END)
+            )
+        ]
+    }
+
+
+@callback
+def async_register_get_history(hass, domain: str, history: HistoryStore):
+    """Register the get_history service of an integration, shared by its platforms."""
+    if hass.services.has_service(domain, SERVICE_GET_HISTORY):
+        return
+    hass.services.async_register(
+        domain,
+        SERVICE_GET_HISTORY,
+        partial(async_handle_get_history, history),
+        schema=GET_HISTORY_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+
+
+@callback
+def async_get_history(hass, key: str) -> HistoryStore:
+    """Return the history store shared by all platform instances."""
+    data_key = f"{key}_history"
+    if data_key not in hass.data:
+        hass.data[data_key] = HistoryStore(hass, key)
+    return hass.data[data_key]
@@ -0,0 +1,123 @@
+"""Oslo market calendar and NAV publish time scheduling."""
+from datetime import date, datetime, time, timedelta
+
+import homeassistant.util.dt as dt_util
+
+TIME_ZONE = dt_util.get_time_zone("Europe/Oslo")
+
+# NAVs are usually published the evening of the trading day they belong to
+DEFAULT_PUBLISH_OFFSET = timedelta(hours=18)
+# Poll at the configured interval this long before and after the expected publish time
+PUBLISH_WINDOW = timedelta(hours=2)
+# Interval used when a NAV is overdue
+OVERDUE_INTERVAL = timedelta(hours=1)
+# Weight of the latest observation when learning the publish time
+LEARNING_RATE = 0.2
+
+
+def _easter(year: int) -> date:
+    """Return Easter Sunday (anonymous Gregorian algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    g = (b - (b + 8) // 25 + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def holidays(year: int) -> set:
+    """Return the days the Norwegian market is closed, besides weekends."""
+    easter = _easter(year)
+    return {
+        date(year, 1, 1),
+        easter - timedelta(days=3),  # Maundy Thursday
+        easter - timedelta(days=2),  # Good Friday
+        easter + timedelta(days=1),  # Easter Monday
+        date(year, 5, 1),
+        date(year, 5, 17),
+        easter + timedelta(days=39),  # Ascension Day
+        easter + timedelta(days=50),  # Whit Monday
+        date(year, 12, 24),
+        date(year, 12, 25),
+        date(year, 12, 26),
+        date(year, 12, 31),
+    }
+
+
+def is_trading_day(day: date) -> bool:
+    """Return True if the market is open on the given day."""
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def next_trading_day(day: date) -> date:
+    """Return the first trading day after the given day."""
+    day += timedelta(days=1)
+    while not is_trading_day(day):
+        day += timedelta(days=1)
+    return day
+
+
+def is_open(now: datetime, opens: time, closes: time) -> bool:
+    """Return True on a trading day between the opening and closing time."""
+    now = now.astimezone(TIME_ZONE)
+    return is_trading_day(now.date()) and opens <= now.time() < closes
+
+
+def parse_date(text: str) -> date:
+    """Parse a NAV date such as 31.12.2021 or 20211231, or return None."""
+    text = str(text).strip()
+    for fmt, length in (("%d.%m.%Y", 10), ("%Y-%m-%d", 10), ("%Y%m%d", 8)):
+        try:
+            return datetime.strptime(text[:length], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _start_of(day: date) -> datetime:
+    """Return local midnight of the given day."""
+    return datetime.combine(day, time(), TIME_ZONE)
+
+
+class PublishSchedule:
+    """Learn when NAVs are published and plan the next refresh around it."""
+
+    def __init__(self, scan_interval: timedelta):
+        self.scan_interval = scan_interval
+        self.offset = DEFAULT_PUBLISH_OFFSET
+        self._dates = {}
+
+    def observe(self, fund: str, nav_date: date, now: datetime):
+        """Record the latest NAV date of a fund, learning when it changes."""
+        if nav_date is None:
+            return
+        previous = self._dates.get(fund)
+        self._dates[fund] = nav_date
+        if previous is None or nav_date <= previous:
+            return
+        offset = now - _start_of(nav_date)
+        if timedelta(0) < offset < timedelta(days=4):
+            self.offset += (offset - self.offset) * LEARNING_RATE
+
+    def forget(self, fund: str):
+        """Stop planning around a fund that is no longer refreshed."""
+        self._dates.pop(fund, None)
+
+    def next_interval(self, now: datetime, funds: list = ()) -> timedelta:
+        """Return the time until the next refresh is worthwhile.
+
+        While any of the configured funds has no NAV date yet, there is no
+        publish time to wait for, and the scan interval is kept.
+        """
+        if not self._dates or any(fund not in self._dates for fund in funds):
+            return self.scan_interval
+        expected = _start_of(next_trading_day(min(self._dates.values()))) + self.offset
+        if now < expected - PUBLISH_WINDOW:
+            return max(expected - PUBLISH_WINDOW - now, self.scan_interval)
+        if now <= expected + PUBLISH_WINDOW:
+            return self.scan_interval
+        return max(self.scan_interval, OVERDUE_INTERVAL)
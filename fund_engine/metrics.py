@@ -0,0 +1,393 @@
+"""Fetch and parse metrics of funds and sources, recorder writes and their sensors."""
+from functools import partial
+import time
+
+from homeassistant.const import EVENT_STATE_CHANGED, UnitOfTime
+from homeassistant.core import CALLBACK_TYPE, callback
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.entity import Entity, EntityCategory, entity_sources
+from homeassistant.helpers.json import json_bytes
+
+# Attributes of the metrics sensors, they change on every refresh
+ATTRIBUTES = frozenset(
+    (
+        "requests",
+        "failures",
+        "timeouts",
+        "bytes",
+        "parses",
+        "parse_ms",
+        "cache_hit_ratio",
+        "last_success",
+        "last_nav_change",
+        "states",
+        "bytes_per_day",
+    )
+)
+# Rough size of a row in the recorder's states table, besides the state itself
+STATE_ROW_BYTES = 100
+# Unique ID endings of the metrics sensors, whose own writes are not measured
+METRIC_UNIQUE_IDS = ("_fetch_time", "_recorder_writes")
+
+
+class FundMetrics:
+    """Counters and timings of the requests for one fund."""
+
+    __slots__ = (
+        "source",
+        "requests",
+        "failures",
+        "timeouts",
+        "bytes",
+        "fetch_time",
+        "last_fetch_time",
+        "parses",
+        "parse_time",
+        "cache_hits",
+        "nav",
+        "last_success",
+        "last_change",
+    )
+
+    def __init__(self, source: str):
+        self.source = source
+        self.requests = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.bytes = 0
+        self.fetch_time = 0.0
+        self.last_fetch_time = None
+        self.parses = 0
+        self.parse_time = 0.0
+        self.cache_hits = 0
+        self.nav = None
+        self.last_success = None
+        self.last_change = None
+
+    def fetched(self, seconds: float, size: int):
+        """Record a response and how long it took."""
+        self.requests += 1
+        self.bytes += size
+        self.fetch_time += seconds
+        self.last_fetch_time = seconds
+
+    def failed(self, timeout: bool = False):
+        """Record a failed request."""
+        self.failures += 1
+        self.timeouts += timeout
+
+    def parsed(self, seconds: float):
+        """Record a parsed response."""
+        self.parses += 1
+        self.parse_time += seconds
+
+    def add(self, other):
+        """Add the counters of another fund, for the totals of a source."""
+        self.requests += other.requests
+        self.failures += other.failures
+        self.timeouts += other.timeouts
+        self.bytes += other.bytes
+        self.fetch_time += other.fetch_time
+        self.parses += other.parses
+        self.parse_time += other.parse_time
+        self.cache_hits += other.cache_hits
+        if other.last_success and (
+            self.last_success is None or other.last_success > self.last_success
+        ):
+            self.last_success = other.last_success
+        if other.last_change and (
+            self.last_change is None or other.last_change > self.last_change
+        ):
+            self.last_change = other.last_change
+
+    def as_dict(self) -> dict:
+        """Return the counters with averages and ratios, for diagnostics."""
+        requests, parses, hits = self.requests, self.parses, self.cache_hits
+        return {
+            "requests": requests,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "bytes": self.bytes,
+            "fetch_ms": round(self.fetch_time / requests * 1000, 1) if requests else None,
+            "parses": parses,
+            "parse_ms": round(self.parse_time / parses * 1000, 1) if parses else None,
+            "cache_hit_ratio": round(hits / (hits + parses), 3) if hits + parses else None,
+            "last_success": self.last_success and self.last_success.isoformat(),
+            "last_nav_change": self.last_change and self.last_change.isoformat(),
+        }
+
+
+class WriteMeter:
+    """Estimate the bytes the recorder stores for the states of an integration.
+
+    Every state change adds a row to the states table, while attributes are
+    stored once per distinct set, the same way the recorder deduplicates them.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.states = 0
+        self.bytes = 0
+        self._attributes = set()
+
+    @callback
+    def async_record(self, state):
+        """Count a state change, leaving out the unrecorded attributes."""
+        state_info = getattr(state, "state_info", None)
+        unrecorded = state_info["unrecorded_attributes"] if state_info else ()
+        attributes = json_bytes(
+            {
+                key: value
+                for key, value in state.attributes.items()
+                if key not in unrecorded
+            }
+        )
+        self.states += 1
+        self.bytes += STATE_ROW_BYTES + len(state.state)
+        # Keep hashes rather than the attributes, the sets pile up over time
+        digest = hash(attributes)
+        if digest not in self._attributes:
+            self._attributes.add(digest)
+            self.bytes += len(attributes)
+
+    def as_dict(self) -> dict:
+        """Return the writes so far and the bytes they add per day."""
+        # Averaged over at least a day, the first hours would extrapolate wildly
+        days = max((time.monotonic() - self.start) / 86400, 1)
+        return {
+            "states": self.states,
+            "bytes": self.bytes,
+            "bytes_per_day": round(self.bytes / days),
+        }
+
+
+class Metrics:
+    """Metrics of every fund of an integration, summed up per source."""
+
+    def __init__(self):
+        self.funds = {}
+        self.recorder = None
+        self._unsub_writes = None
+        # (scope, key) of the metrics sensors added so far
+        self._sensors = set()
+
+    def fund(self, fund: str, source: str) -> FundMetrics:
+        """Return the metrics of a fund, created on first use."""
+        if fund not in self.funds:
+            self.funds[fund] = FundMetrics(source)
+        return self.funds[fund]
+
+    def success(self, fund: str, nav, now):
+        """Record good data for a fund, noting when its NAV last changed."""
+        metrics = self.funds.get(fund)
+        if metrics is None:
+            return
+        if nav != metrics.nav:
+            metrics.nav = nav
+            metrics.last_change = now
+        metrics.last_success = now
+
+    def source(self, source: str) -> FundMetrics:
+        """Return the metrics of all funds from a source, added up."""
+        total = FundMetrics(source)
+        for metrics in self.funds.values():
+            if metrics.source == source:
+                total.add(metrics)
+        return total
+
+    def _new(self, scope: str, key: str) -> bool:
+        """Return True the first time a sensor of key is asked for in scope."""
+        if (scope, key) in self._sensors:
+            return False
+        self._sensors.add((scope, key))
+        return True
+
+    def fund_sensors(self, scope: str, funds: list) -> list:
+        """Return the metrics sensors of funds without one in scope yet.
+
+        scope is the config entry ID, or the domain for YAML, and keeps the
+        unique IDs of both apart. A fund on several platforms of a scope
+        shares its metrics, so it gets one sensor.
+        """
+        return [
+            MetricsSensor(scope, fund, partial(self.funds.get, fund))
+            for fund in funds
+            if self._new(scope, fund)
+        ]
+
+    def source_sensors(self, scope: str, sources: list, name: str) -> list:
+        """Return the metrics sensors of sources and the recorder writes of name.
+
+        They show the metrics shared by every platform of the integration, so
+        they are only returned once per scope.
+        """
+        sensors = [
+            MetricsSensor(scope, source, partial(self.source, source))
+            for source in sorted(sources)
+            if self._new(scope, source)
+        ]
+        if self._new(scope, None):
+            sensors.append(
+                RecorderSensor(scope, name, partial(getattr, self, "recorder"))
+            )
+        return sensors
+
+    def remove_fund(self, scope: str, fund: str):
+        """Forget a fund that is no longer refreshed, and its sensor."""
+        self.funds.pop(fund, None)
+        self._sensors.discard((scope, fund))
+
+    @callback
+    def async_forget_sensors(self, scope: str):
+        """Forget the sensors of a scope, so that they are added again on reload."""
+        self._sensors = {item for item in self._sensors if item[0] != scope}
+
+    @callback
+    def async_measure_writes(self, hass, domain: str) -> CALLBACK_TYPE:
+        """Start estimating the recorder writes of the fund entities of domain.
+
+        Diagnostic entities, such as the metrics sensors, are left out. Returns
+        async_stop_measuring, to call on unload or stop.
+        """
+        if self._unsub_writes is not None:
+            return self.async_stop_measuring
+        if self.recorder is None:
+            self.recorder = WriteMeter()
+        meter = self.recorder
+        sources = entity_sources(hass)
+        registry = er.async_get(hass)
+
+        @callback
+        def _async_state_changed(event):
+            state = event.data.get("new_state")
+            if state is None:
+                return
+            if sources.get(state.entity_id, {}).get("domain") != domain:
+                return
+            entry = registry.async_get(state.entity_id)
+            if entry is not None and (
+                entry.entity_category == EntityCategory.DIAGNOSTIC
+                or entry.unique_id.endswith(METRIC_UNIQUE_IDS)
+            ):
+                return
+            meter.async_record(state)
+
+        self._unsub_writes = hass.bus.async_listen(
+            EVENT_STATE_CHANGED, _async_state_changed
+        )
+        return self.async_stop_measuring
+
+    @callback
+    def async_stop_measuring(self, *_):
+        """Stop estimating the recorder writes, keeping the estimate so far."""
+        if self._unsub_writes is not None:
+            self._unsub_writes()
+            self._unsub_writes = None
+
+    def as_dict(self) -> dict:
+        """Return the metrics of every source and fund, for diagnostics."""
+        sources = sorted({metrics.source for metrics in self.funds.values()})
+        metrics = {
+            "sources": {source: self.source(source).as_dict() for source in sources},
+            "funds": {fund: metrics.as_dict() for fund, metrics in self.funds.items()},
+        }
+        if self.recorder is not None:
+            metrics["recorder"] = self.recorder.as_dict()
+        return metrics
+
+
+@callback
+def async_get_metrics(hass, key: str) -> Metrics:
+    """Return the metrics shared by all platform instances of an integration."""
+    data_key = f"{key}_metrics"
+    if data_key not in hass.data:
+        hass.data[data_key] = Metrics()
+    return hass.data[data_key]
+
+
+class MetricsSensor(Entity):
+    """Average fetch time of a source or a fund, with the other metrics."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _unrecorded_attributes = ATTRIBUTES
+
+    def __init__(self, scope: str, key: str, read):
+        self._scope = scope
+        self._key = key
+        self._read = read
+        self._metrics = {}
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return f"{self._key} fetch time"
+
+    @property
+    def unique_id(self):
+        """Return the unique ID for the sensor."""
+        return f"{self._scope}_{self._key}_fetch_time"
+
+    @property
+    def state(self):
+        """Return the average fetch time."""
+        return self._metrics.get("fetch_ms")
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of the fetch time."""
+        return UnitOfTime.MILLISECONDS
+
+    @property
+    def icon(self):
+        """Return the sensor icon."""
+        return "mdi:timer-outline"
+
+    @property
+    def extra_state_attributes(self):
+        """Return the other metrics."""
+        return {
+            key: value for key, value in self._metrics.items() if key != "fetch_ms"
+        }
+
+    async def async_update(self):
+        """Read the metrics counted by the fetch engine."""
+        metrics = self._read()
+        self._metrics = metrics.as_dict() if metrics is not None else {}
+
+
+class RecorderSensor(MetricsSensor):
+    """Estimated bytes per day the recorder stores for the integration."""
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return f"{self._key} recorder writes"
+
+    @property
+    def unique_id(self):
+        """Return the unique ID for the sensor."""
+        return f"{self._scope}_recorder_writes"
+
+    @property
+    def state(self):
+        """Return the estimated bytes per day."""
+        return self._metrics.get("bytes_per_day")
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of the estimate."""
+        return "B/d"
+
+    @property
+    def icon(self):
+        """Return the sensor icon."""
+        return "mdi:database-arrow-up"
+
+    @property
+    def extra_state_attributes(self):
+        """Return the states and bytes written so far."""
+        return {
+            key: value
+            for key, value in self._metrics.items()
+            if key != "bytes_per_day"
+        }
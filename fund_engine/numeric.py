@@ -0,0 +1,26 @@
+"""Locale independent parsing of the scraped numbers."""
+
+
+def to_float(value) -> float:
+    """Parse values such as 12.5, "1,23 %" or "1 234,56" into a float, or None."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    text = value.replace("%", "").replace("\xa0", "").replace(" ", "").strip()
+    if text.rfind(",") > text.rfind("."):
+        text = text.replace(".", "").replace(",", ".")
+    else:
+        text = text.replace(",", "")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def numeric_attributes(attributes: dict) -> dict:
+    """Return the attributes with percentages as floats, keeping the keys."""
+    return {
+        key: to_float(value) if isinstance(value, str) and value.endswith("%") else value
+        for key, value in attributes.items()
+    }
@@ -0,0 +1,146 @@
+"""Fund snapshot pages parsed with BeautifulSoup, such as those of Morningstar LT.
+
+Only imported by the integrations that require beautifulsoup4.
+"""
+from functools import partial
+import logging
+
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+
+from homeassistant.const import ATTR_ATTRIBUTION
+
+from .compact import compact
+from .engine import Source, StreamEnd, trend_icon
+
+_LOGGER = logging.getLogger(__name__)
+
+ATTRIBUTION = "Data provided by Morningstar"
+DEFAULT_PARSER = "html.parser"
+PARSERS = ["html.parser", "lxml"]
+LT_URL = "https://lt.morningstar.com/cahq7idbwv/snapshot/snapshot.aspx?id={}"
+
+
+def _is_section(classes: frozenset, ids: frozenset, name, attrs) -> bool:
+    attrs = attrs or {}
+    if name == "h1":
+        return True
+    if attrs.get("id") in ids:
+        return True
+    tag_class = attrs.get("class") or ""
+    if isinstance(tag_class, str):
+        tag_class = tag_class.split()
+    return not classes.isdisjoint(tag_class)
+
+
+def sections(classes: set = frozenset(), ids: set = frozenset()) -> SoupStrainer:
+    """Match the fund name and the page sections holding the fund data.
+
+    A partial of a module function, unlike a closure, can be sent to the
+    worker processes of the parse pool.
+    """
+    return SoupStrainer(partial(_is_section, frozenset(classes), frozenset(ids)))
+
+
+def release(soup: BeautifulSoup):
+    """Free a parse tree now, instead of leaving its reference cycles to the collector.
+
+    Decomposing the soup only clears its root, so the elements below it are
+    decomposed one by one.
+    """
+    for element in list(soup.contents):
+        if isinstance(element, Tag):
+            element.decompose()
+        else:
+            element.extract()
+    soup.decompose()
+
+
+class SnapshotSource(Source):
+    """Snapshot pages, parsed with BeautifulSoup and read by an extract function."""
+
+    def __init__(
+        self,
+        url: str,
+        extract,
+        strainer: SoupStrainer,
+        features: str = DEFAULT_PARSER,
+        parse_only: bool = True,
+        name: str = "Morningstar",
+        stream_end: StreamEnd = None,
+    ):
+        self.name = name
+        self.stream_end = stream_end
+        self.parse_options = (extract, features, parse_only)
+        self._url = url
+        self._extract = extract
+        self._strainer = strainer if parse_only else None
+        self._features = features
+
+    def url(self, fund: str) -> str:
+        """Return the snapshot page of a fund."""
+        return self._url.format(fund)
+
+    def parse(self, body: str, fund: str, url: str) -> dict:
+        """Parse the page, or only the sections holding the fund data."""
+        soup = BeautifulSoup(body, self._features, parse_only=self._strainer)
+        try:
+            return compact(self._extract(soup, fund, url))
+        finally:
+            release(soup)
+
+
+LT_SECTIONS = sections(ids={"KeyStatsLatestNav", "TrailingReturns"})
+# The same sections as they close in the page source, to stop reading there
+LT_END = StreamEnd(
+    ("<h1", "</h1>"),
+    ('id="KeyStatsLatestNav"', "</tr>"),
+    ('id="TrailingReturns"', "</table>"),
+)
+
+
+def parse_lt(soup: BeautifulSoup, fund: str, url: str) -> dict:
+    """Extract the fund data from a Morningstar LT snapshot page."""
+    try:
+        name = soup.h1.text
+        stat = soup.select("#KeyStatsLatestNav td")[0].text[4:].replace(",", ".")
+        unit = soup.select("#KeyStatsLatestNav td")[0].text[:3]
+        pcts = soup.select("#TrailingReturns > table > tbody > tr > td.colSecurity")
+        span = soup.select("#TrailingReturns > table > tbody > tr > th")
+        date = soup.select("#KeyStatsLatestNav > th > span")[0].text
+        oday = float(pcts[1].text.replace(",", "."))
+        icon = trend_icon(oday)
+        attr = {ATTR_ATTRIBUTION: ATTRIBUTION, "Dato": date}
+        hist = {span[i].text: pcts[i].text + " %" for i in range(len(pcts))}
+        attr.update(hist)
+        attr["URL"] = url
+        _LOGGER.info("%s successfully scraped from Morningstar LT", name)
+        return {"name": name, "stat": stat, "unit": unit, "icon": icon, "attr": attr}
+    except (IndexError, AttributeError, ValueError):
+        _LOGGER.warning("Unable to extract data from Morningstar LT for %s", fund)
+        return None
+
+
+class LtSource(SnapshotSource):
+    """Snapshot pages of Morningstar LT.
+
+    The morningstar and lt_morningstar integrations both read them with this
+    source, so they share the fetches of funds they have in common.
+    """
+
+    def __init__(
+        self,
+        features: str = DEFAULT_PARSER,
+        parse_only: bool = True,
+        streaming: bool = True,
+        name: str = "Morningstar LT",
+        url: str = LT_URL,
+    ):
+        super().__init__(
+            url,
+            parse_lt,
+            LT_SECTIONS,
+            features,
+            parse_only,
+            name,
+            LT_END if streaming else None,
+        )
@@ -0,0 +1,48 @@
+"""Persist the last good data of each fund across restarts."""
+import asyncio
+
+from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+import homeassistant.util.dt as dt_util
+
+from .compact import compact
+
+STORAGE_VERSION = 1
+SAVE_DELAY = 30
+
+
+class FundStore:
+    """Last good data per fund, saved under .storage."""
+
+    def __init__(self, hass, key: str):
+        self._store = Store(hass, STORAGE_VERSION, key)
+        self._funds = None
+        self._lock = asyncio.Lock()
+
+    async def async_load(self) -> dict:
+        """Load the stored funds once, shared by every platform instance."""
+        async with self._lock:
+            if self._funds is None:
+                self._funds = compact(await self._store.async_load() or {})
+        return self._funds
+
+    def get(self, fund: str) -> tuple:
+        """Return the stored data of a fund and when it was fetched."""
+        stored = self._funds.get(fund)
+        if stored is None:
+            return None, None
+        return stored["data"], dt_util.parse_datetime(stored["fetched"])
+
+    @callback
+    def async_update(self, fund: str, data: dict, fetched):
+        """Store fresh data for a fund and schedule a save."""
+        self._funds[fund] = {"data": data, "fetched": fetched.isoformat()}
+        self._store.async_delay_save(lambda: self._funds, SAVE_DELAY)
+
+
+@callback
+def async_get_store(hass, key: str) -> FundStore:
+    """Return the store shared by all platform instances of an integration."""
+    if key not in hass.data:
+        hass.data[key] = FundStore(hass, key)
+    return hass.data[key]
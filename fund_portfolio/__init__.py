@@ -0,0 +1 @@
+"""fund_portfolio sensor."""
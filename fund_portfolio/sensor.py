@@ -0,0 +1,212 @@
+"""Portfolio value and returns from the fund sensors."""
+import logging
+
+import numpy as np
+import voluptuous as vol
+
+import homeassistant.helpers.config_validation as cv
+from homeassistant.components.sensor import PLATFORM_SCHEMA
+from homeassistant.const import CONF_ENTITY_ID, CONF_NAME, CONF_UNIT_OF_MEASUREMENT
+from homeassistant.core import callback
+from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.event import async_track_state_change_event
+
+from ..fund_engine.numeric import to_float
+
+_LOGGER = logging.getLogger(__name__)
+
+CONF_FUNDS = "funds"
+CONF_RATE = "rate"
+CONF_RATE_ENTITY = "rate_entity"
+CONF_RETURNS = "returns"
+CONF_UNITS = "units"
+DEFAULT_NAME = "Fund portfolio"
+DEFAULT_UNIT = "kr"
+# Portfolio attribute and the fund attributes it can be read from
+DEFAULT_RETURNS = {
+    "1 dag": ["1 dag", "Intradag"],
+    "Hittil i år": ["Hittil i år", "I år"],
+    "1 år": ["1 år"],
+}
+
+FUND_SCHEMA = vol.Schema(
+    {
+        vol.Required(CONF_ENTITY_ID): cv.entity_id,
+        vol.Required(CONF_UNITS): vol.Coerce(float),
+        vol.Exclusive(CONF_RATE, CONF_RATE): vol.Coerce(float),
+        vol.Exclusive(CONF_RATE_ENTITY, CONF_RATE): cv.entity_id,
+    }
+)
+
+PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
+    {
+        vol.Required(CONF_FUNDS): vol.All(cv.ensure_list, [FUND_SCHEMA]),
+        vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
+        vol.Optional(CONF_UNIT_OF_MEASUREMENT, default=DEFAULT_UNIT): cv.string,
+        vol.Optional(CONF_RETURNS, default=DEFAULT_RETURNS): {
+            cv.string: vol.All(cv.ensure_list, [cv.string])
+        },
+    }
+)
+
+
+def _to_float(value) -> float:
+    """Parse a state or attribute value, using NaN for missing values."""
+    value = to_float(value)
+    return np.nan if value is None else value
+
+
+def _assign(array: np.ndarray, rows: list, values) -> bool:
+    """Set the rows of an array, returning True if any value changed."""
+    values = np.broadcast_to(values, array[rows].shape)
+    if np.array_equal(array[rows], values, equal_nan=True):
+        return False
+    array[rows] = values
+    return True
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """Set up the portfolio sensor."""
+    async_add_entities(
+        [
+            FundPortfolioSensor(
+                config[CONF_NAME],
+                config[CONF_UNIT_OF_MEASUREMENT],
+                config[CONF_FUNDS],
+                config[CONF_RETURNS],
+            )
+        ]
+    )
+
+
+class FundPortfolioSensor(Entity):
+    """Total value and value weighted returns of a set of funds."""
+
+    def __init__(self, name: str, unit: str, funds: list, returns: dict):
+        self._name = name
+        self._unit = unit
+        self._state = None
+        self._attr = {}
+        self._return_names = list(returns)
+        self._return_keys = list(returns.values())
+        self._units = np.array([fund[CONF_UNITS] for fund in funds])
+        self._rates = np.array(
+            [
+                np.nan if CONF_RATE_ENTITY in fund else fund.get(CONF_RATE, 1.0)
+                for fund in funds
+            ]
+        )
+        self._prices = np.full(len(funds), np.nan)
+        self._returns = np.full((len(funds), len(returns)), np.nan)
+        self._rows = {}
+        self._rate_rows = {}
+        for row, fund in enumerate(funds):
+            self._rows.setdefault(fund[CONF_ENTITY_ID], []).append(row)
+            if CONF_RATE_ENTITY in fund:
+                self._rate_rows.setdefault(fund[CONF_RATE_ENTITY], []).append(row)
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return self._name
+
+    @property
+    def should_poll(self):
+        """The sensor is updated when a fund changes."""
+        return False
+
+    @property
+    def state(self):
+        """Return the total value of the portfolio."""
+        return self._state
+
+    @property
+    def unit_of_measurement(self):
+        """Return the currency of the portfolio."""
+        return self._unit
+
+    @property
+    def icon(self):
+        """Return the sensor icon."""
+        return "mdi:briefcase-outline"
+
+    @property
+    def extra_state_attributes(self):
+        """Return the value weighted returns."""
+        return self._attr
+
+    async def async_added_to_hass(self):
+        """Read the current fund states and follow their changes."""
+        for entity_id in list(self._rows) + list(self._rate_rows):
+            self._update_rows(entity_id, self.hass.states.get(entity_id))
+        self._compute()
+        self.async_on_remove(
+            async_track_state_change_event(
+                self.hass,
+                list(self._rows) + list(self._rate_rows),
+                self._async_state_changed,
+            )
+        )
+
+    @callback
+    def _async_state_changed(self, event):
+        """Recompute when the price, a return or a rate actually changed."""
+        if self._update_rows(event.data["entity_id"], event.data["new_state"]):
+            self._compute()
+            self.async_write_ha_state()
+
+    def _update_rows(self, entity_id: str, state) -> bool:
+        """Copy a fund or rate state into the arrays, returning True on change.
+
+        Unavailable funds and rates keep their last known values, so they
+        still count in the total.
+        """
+        changed = False
+        value = _to_float(state.state) if state else np.nan
+        if np.isnan(value):
+            return changed
+        if entity_id in self._rate_rows:
+            changed |= _assign(self._rates, self._rate_rows[entity_id], value)
+        if entity_id in self._rows:
+            rows = self._rows[entity_id]
+            returns = [self._read_return(state, keys) for keys in self._return_keys]
+            changed |= _assign(self._prices, rows, value)
+            changed |= _assign(self._returns, rows, returns)
+        return changed
+
+    @staticmethod
+    def _read_return(state, keys: list) -> float:
+        """Return the first of the given attributes that the fund has."""
+        if state is None:
+            return np.nan
+        for key in keys:
+            if key in state.attributes:
+                return _to_float(state.attributes[key])
+        return np.nan
+
+    def _compute(self):
+        """Compute the total value and the weighted returns in one pass.
+
+        The state is unknown until every fund and rate has had a value, rather
+        than a total of only some of the funds.
+        """
+        values = self._units * self._prices * self._rates
+        valid = ~np.isnan(values)
+        if not valid.all():
+            self._state = None
+            self._attr = {}
+            return
+        weights = values[:, np.newaxis]
+        known = ~np.isnan(self._returns)
+        total = np.where(known, self._returns * weights, 0.0).sum(axis=0)
+        weight = np.where(known, weights, 0.0).sum(axis=0)
+        returns = np.divide(
+            total, weight, out=np.full(weight.shape, np.nan), where=weight != 0
+        )
+        self._state = round(float(values.sum()), 2)
+        self._attr = {
+            name: round(float(value), 2)
+            for name, value in zip(self._return_names, returns)
+            if not np.isnan(value)
+        }
+        self._attr["Fond"] = len(values)
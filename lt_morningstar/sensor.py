@@ -3,91 +3,169 @@ import asyncio
 from datetime import timedelta
 import logging
 
-import aiohttp
-import async_timeout
-from bs4 import BeautifulSoup
 import voluptuous as vol
 
 from homeassistant.components.sensor import PLATFORM_SCHEMA
-from homeassistant.const import (ATTR_ATTRIBUTION, CONF_CURRENCY, CONF_SCAN_INTERVAL)
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.const import (
+    ATTR_ATTRIBUTION, CONF_CURRENCY, CONF_SCAN_INTERVAL, EVENT_HOMEASSISTANT_STOP)
+from homeassistant.core import callback
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.update_coordinator import CoordinatorEntity, UpdateFailed
+
+from ..fund_engine.cache import ResponseCache
+from ..fund_engine.coordinator import FundCoordinator
+from ..fund_engine.engine import ParsePool, async_get_engine
+from ..fund_engine.metrics import async_get_metrics
+from ..fund_engine.numeric import numeric_attributes, to_float
+from ..fund_engine.pages import DEFAULT_PARSER, LT_URL, PARSERS, LtSource
+from ..fund_engine.store import async_get_store
 
 _LOGGER = logging.getLogger(__name__)
 
-ATTRIBUTION = 'Data provided by Morningstar'
+CONF_ADAPTIVE = 'adaptive_scan_interval'
 CONF_FUNDS = 'funds'
+CONF_NUMERIC = 'numeric'
+CONF_PARALLEL_REQUESTS = 'parallel_requests'
+CONF_PARSE_ONLY = 'parse_only_sections'
+CONF_PARSE_PROCESSES = 'parse_processes'
+CONF_PARSE_WORKERS = 'parse_workers'
+CONF_PARSER = 'parser'
+CONF_STREAMING = 'streaming'
 DEFAULT_CURRENCY = 'kr'
+DEFAULT_PARALLEL_REQUESTS = 5
+DEFAULT_PARSE_WORKERS = 2
 DEFAULT_SCAN_INTERVAL = timedelta(minutes=30)
 DOMAIN = 'lt_morningstar'
-URL = 'https://lt.morningstar.com/cahq7idbwv/snapshot/snapshot.aspx?id={}'
+SOURCE = 'Morningstar (LT)'
+URL = LT_URL
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     {
         vol.Required(CONF_FUNDS): vol.All(cv.ensure_list, [cv.string]),
         vol.Optional(CONF_CURRENCY, default=DEFAULT_CURRENCY): cv.string,
-        vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL): cv.time_period
+        vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL): cv.time_period,
+        vol.Optional(CONF_PARALLEL_REQUESTS, default=DEFAULT_PARALLEL_REQUESTS): cv.positive_int,
+        vol.Optional(CONF_PARSER, default=DEFAULT_PARSER): vol.In(PARSERS),
+        vol.Optional(CONF_PARSE_ONLY, default=True): cv.boolean,
+        vol.Optional(CONF_STREAMING, default=True): cv.boolean,
+        vol.Optional(CONF_PARSE_WORKERS, default=DEFAULT_PARSE_WORKERS): cv.positive_int,
+        vol.Optional(CONF_PARSE_PROCESSES, default=False): cv.boolean,
+        vol.Optional(CONF_ADAPTIVE, default=True): cv.boolean,
+        vol.Optional(CONF_NUMERIC, default=False): cv.boolean
     }
 )
 
 
-async def async_scape(sess, fund):
-    try:
-        with async_timeout.timeout(10):
-            response = await sess.get(URL.format(fund))
-        _LOGGER.info('Response from Morningstar (LT): %s', response.status)
-        html = await response.text()
-        soup = BeautifulSoup(html, 'html.parser')
-        try:
-            name = soup.h1.text
-            stat = soup.select('#KeyStatsLatestNav td')[0].text.replace(',', '.')[4:]
-            pcts = soup.select('#TrailingReturns > table > tbody > tr > td.colSecurity')
-            span = soup.select('#TrailingReturns > table > tbody > tr > th')
-            oday = float(pcts[1].text.replace(',', '.'))
-            icon = 'mdi:trending-up' if oday > 0 else 'mdi:trending-down' if oday < 0 else 'mdi:trending-neutral'
-            attr = {
-                ATTR_ATTRIBUTION: ATTRIBUTION,
-                'Dato': soup.select('#KeyStatsLatestNav > th > span')[0].text
-            }
-            hist = {span[i].text: pcts[i].text + ' %' for i in range(len(pcts))}
-            attr.update(hist)
-            attr['URL'] = URL.format(fund)
-            data = {'name': name, 'stat': stat, 'icon': icon, 'attr': attr}
-            _LOGGER.info('%s Successfully scraped from Morningstar (LT)', name)
-            return data
-        except (IndexError, AttributeError):
-            _LOGGER.warning('Unable to extract data from Morningstar for %s', fund)
-            return
-    except (asyncio.TimeoutError, aiohttp.ClientError):
-        _LOGGER.info('Unable to scrape data from Morningstar (LT) for %s', fund)
-        return
+class MorningstarLtCoordinator(FundCoordinator):
+    """Refresh every configured fund in one scheduled cycle."""
+
+    def __init__(self, hass, funds, parallel_requests, update_interval, parser, parse_only,
+                 parse_workers, adaptive=True, store=None, metrics=None, streaming=True,
+                 parse_processes=False):
+        super().__init__(
+            hass, _LOGGER, DOMAIN, funds, update_interval, adaptive, store, metrics=metrics)
+        self._engine = async_get_engine(hass)
+        # The same source as the morningstar integration, which shares the fetches
+        self._source = LtSource(parser, parse_only, streaming, SOURCE, URL)
+        self.pool = ParsePool(parse_workers, DOMAIN, parse_processes)
+        self._semaphore = asyncio.Semaphore(parallel_requests)
+        self.cache = ResponseCache()
+
+    def nav(self, data):
+        """Return the NAV of a fund."""
+        return data['stat']
+
+    def nav_date(self, data):
+        """Return the date of the NAV of a fund."""
+        return data['attr']['Dato']
+
+    async def _async_fetch(self, fund):
+        """Fetch a single fund, bounded by the semaphore."""
+        async with self._semaphore:
+            return await self._engine.async_fetch(
+                self._source, fund, self.pool, self.cache, self.metrics)
+
+    async def _async_update_data(self):
+        """Refresh all funds."""
+        data = await self.async_fetch_all()
+        if self.funds and not data:
+            raise UpdateFailed('No data received from Morningstar (LT)')
+        _LOGGER.debug(
+            'Parsed %s pages, skipped %s unchanged pages and %s state writes',
+            self.cache.parses, self.cache.parses_skipped, self.cache.writes_skipped)
+        if self.metrics is not None:
+            _LOGGER.debug('Metrics: %s', self.metrics.source(SOURCE).as_dict())
+            if self.metrics.recorder is not None:
+                _LOGGER.debug('Recorder writes: %s', self.metrics.recorder.as_dict())
+        return data
 
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the sensor."""
     _LOGGER.info('Setting up sensors')
-    sess = async_get_clientsession(hass)
     funds = config.get(CONF_FUNDS, [])
     unit = config.get(CONF_CURRENCY)
-    for fund in funds:
-        async_add_entities([MorningstarLtSensor(sess, fund, unit)], True)
-        _LOGGER.info('Setup of %s complete', fund[-10:])
-
-
-class MorningstarLtSensor(Entity):
+    coordinator = MorningstarLtCoordinator(
+        hass, funds, config[CONF_PARALLEL_REQUESTS], config[CONF_SCAN_INTERVAL],
+        config[CONF_PARSER], config[CONF_PARSE_ONLY], config[CONF_PARSE_WORKERS],
+        config[CONF_ADAPTIVE], async_get_store(hass, DOMAIN),
+        async_get_metrics(hass, DOMAIN), config[CONF_STREAMING], config[CONF_PARSE_PROCESSES])
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, coordinator.pool.shutdown)
+    if _LOGGER.isEnabledFor(logging.DEBUG):
+        hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP,
+            coordinator.metrics.async_measure_writes(hass, DOMAIN))
+    await coordinator.async_start()
+    async_add_entities([
+        MorningstarLtSensor(coordinator, fund, unit, config[CONF_NUMERIC]) for fund in funds])
+    _LOGGER.info('Setup of %s funds complete', len(funds))
+
+
+class MorningstarLtSensor(CoordinatorEntity, Entity):
     """Representation of the sensor."""
 
-    def __init__(self, sess, fund, unit):
+    # The same for every state, no need to store them with each one
+    _unrecorded_attributes = frozenset((ATTR_ATTRIBUTION, 'URL'))
+
+    def __init__(self, coordinator, fund, unit, numeric=False):
         """Initialize the sensor."""
-        self._sess = sess
+        super().__init__(coordinator)
         self._fund = fund
+        self._numeric = numeric
         self._unit = unit
-        self._data = None
         self._name = None
         self._stat = None
         self._icon = None
         self._attr = None
+        self._data = None
+        self._stale = coordinator.stale.get(fund)
+        self._set_data((coordinator.data or {}).get(fund))
+
+    def _set_data(self, data):
+        """Copy the coordinator data for this fund to the sensor."""
+        if data:
+            self._data = data
+            self._name = data['name']
+            self._icon = data['icon']
+            if self._numeric:
+                self._stat = to_float(data['stat'])
+                self._attr = numeric_attributes(data['attr'])
+            else:
+                self._stat = data['stat']
+                self._attr = data['attr']
+
+    @callback
+    def _handle_coordinator_update(self):
+        """Update the sensor from the coordinator, unless nothing changed."""
+        data = (self.coordinator.data or {}).get(self._fund)
+        stale = self.coordinator.stale.get(self._fund)
+        if data is self._data and stale == self._stale:
+            self.coordinator.cache.writes_skipped += 1
+            return
+        self._stale = stale
+        self._set_data(data)
+        self.async_write_ha_state()
 
     @property
     def name(self):
@@ -116,17 +194,7 @@ class MorningstarLtSensor(Entity):
 
     @property
     def extra_state_attributes(self):
-        """Return the extra state attributes of the sensor."""
-        return self._attr
-
-    async def async_update(self):
-        """Updates the sensor data."""
-        self._data = await async_scape(self._sess, self._fund)
-        try:
-            self._name = self._data['name']
-            self._stat = self._data['stat']
-            self._icon = self._data['icon']
-            self._attr = self._data['attr']
-            _LOGGER.info('Update of %s complete', self._name)
-        except TypeError:
-            _LOGGER.info('Update failed')
+        """Return the extra state attributes of the sensor, marked while they are stale."""
+        if self._stale is None or self._attr is None:
+            return self._attr
+        return {**self._attr, 'stale': True, 'fetched': self._stale.isoformat()}
@@ -1 +1,15 @@
 """morningstar sensor."""
+from homeassistant.const import Platform
+
+PLATFORMS = [Platform.SENSOR]
+
+
+async def async_setup_entry(hass, entry) -> bool:
+    """Set up the funds of a config entry."""
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    return True
+
+
+async def async_unload_entry(hass, entry) -> bool:
+    """Unload the funds of a config entry."""
+    return await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
@@ -0,0 +1,199 @@
+"""Config flow for Morningstar, with bulk import of fund ids."""
+from abc import ABC, abstractmethod
+import re
+
+import voluptuous as vol
+
+from homeassistant import config_entries
+from homeassistant.core import callback
+from homeassistant.helpers import selector
+import homeassistant.helpers.config_validation as cv
+
+from ..fund_engine.store import async_get_store
+from .sensor import CONF_FUNDS, CONF_LT_FUNDS, DOMAIN, async_validate_funds
+
+CONF_ADD_FUNDS = "add_funds"
+CONF_ADD_LT_FUNDS = "add_lt_funds"
+CONF_REMOVE = "remove"
+FUND_ID = re.compile(r"[0-9A-Z]{10}")
+# The key of a YAML line such as "funds:" or "lt_funds: [...]"
+KEY = re.compile(r"^[\w-]+:")
+SEPARATORS = re.compile(r"[\s,;\[\]]+")
+TEXT = selector.TextSelector(selector.TextSelectorConfig(multiline=True))
+
+
+def parse_funds(text: str) -> tuple:
+    """Split pasted text into fund ids, returning the ids and the malformed words.
+
+    Ids may be separated by spaces, commas, semicolons or new lines, and
+    YAML keys, list markers and comments are ignored, so a funds list can be
+    pasted straight from configuration.yaml.
+    """
+    funds, malformed = [], []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip().lstrip("-").strip()
+        line = KEY.sub("", line)
+        for word in SEPARATORS.split(line.strip()):
+            if not word:
+                continue
+            fund = word.upper()
+            if not FUND_ID.fullmatch(fund):
+                malformed.append(word)
+            elif fund not in funds:
+                funds.append(fund)
+    return funds, malformed
+
+
+class FundsFlow(ABC):
+    """Validate new funds concurrently, shared by the config and options flows."""
+
+    _pending = ()
+    _valid = {}
+    _task = None
+
+    async def async_step_validate(self, user_input=None):
+        """Fetch the new funds in the background, showing progress meanwhile."""
+        if self._task is None:
+            self._task = self.hass.async_create_task(
+                async_validate_funds(self.hass, self._pending)
+            )
+        if not self._task.done():
+            return self.async_show_progress(
+                step_id="validate",
+                progress_action="validate",
+                progress_task=self._task,
+                description_placeholders={"count": str(len(self._pending))},
+            )
+        self._valid = self._task.result()
+        self._task = None
+        return self.async_show_progress_done(next_step_id="confirm")
+
+    async def async_step_confirm(self, user_input=None):
+        """List the funds that weren't found before saving the others."""
+        invalid = [fund for fund in self._pending if fund not in self._valid]
+        if not invalid or user_input is not None:
+            return self._async_finish()
+        return self.async_show_form(
+            step_id="confirm",
+            description_placeholders={
+                "valid": str(len(self._valid)),
+                "invalid": ", ".join(fund for fund, _ in invalid),
+            },
+        )
+
+    @abstractmethod
+    def _async_finish(self):
+        """Save the validated funds and end the flow."""
+
+
+def _pending(user_input: dict, funds_key: str, lt_funds_key: str) -> tuple:
+    """Return the (fund, morn) pairs entered in a form and the malformed words."""
+    funds, malformed = parse_funds(user_input.get(funds_key, ""))
+    lt_funds, lt_malformed = parse_funds(user_input.get(lt_funds_key, ""))
+    pending = [(fund, True) for fund in funds] + [(fund, False) for fund in lt_funds]
+    return pending, malformed + lt_malformed
+
+
+class MorningstarConfigFlow(FundsFlow, config_entries.ConfigFlow, domain=DOMAIN):
+    """Add Morningstar funds from a pasted list."""
+
+    VERSION = 1
+
+    async def async_step_user(self, user_input=None):
+        """Ask for the fund ids."""
+        await self.async_set_unique_id(DOMAIN)
+        self._abort_if_unique_id_configured()
+        errors = {}
+        malformed = []
+        if user_input is not None:
+            self._pending, malformed = _pending(user_input, CONF_FUNDS, CONF_LT_FUNDS)
+            if malformed:
+                errors["base"] = "malformed"
+            elif not self._pending:
+                errors["base"] = "no_funds"
+            else:
+                return await self.async_step_validate()
+        return self.async_show_form(
+            step_id="user",
+            data_schema=vol.Schema(
+                {
+                    vol.Optional(CONF_FUNDS, default=""): TEXT,
+                    vol.Optional(CONF_LT_FUNDS, default=""): TEXT,
+                }
+            ),
+            errors=errors,
+            description_placeholders={"malformed": ", ".join(malformed)},
+        )
+
+    def _async_finish(self):
+        """Create the entry with the valid funds, if any."""
+        if not self._valid:
+            return self.async_abort(reason="no_valid_funds")
+        return self.async_create_entry(
+            title="Morningstar",
+            data={},
+            options={
+                CONF_FUNDS: [fund for fund, morn in self._valid if morn],
+                CONF_LT_FUNDS: [fund for fund, morn in self._valid if not morn],
+            },
+        )
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        """Return the flow adding and removing funds."""
+        return MorningstarOptionsFlow(config_entry)
+
+
+class MorningstarOptionsFlow(FundsFlow, config_entries.OptionsFlowWithConfigEntry):
+    """Add and remove funds of the config entry."""
+
+    _kept = ()
+
+    async def async_step_init(self, user_input=None):
+        """Ask for funds to add and to remove."""
+        current = [(fund, True) for fund in self.options.get(CONF_FUNDS, [])]
+        current += [(fund, False) for fund in self.options.get(CONF_LT_FUNDS, [])]
+        errors = {}
+        malformed = []
+        if user_input is not None:
+            remove = set(user_input.get(CONF_REMOVE, []))
+            self._kept = [(fund, morn) for fund, morn in current if fund not in remove]
+            pending, malformed = _pending(user_input, CONF_ADD_FUNDS, CONF_ADD_LT_FUNDS)
+            self._pending = [item for item in pending if item not in self._kept]
+            if malformed:
+                errors["base"] = "malformed"
+            elif self._pending:
+                return await self.async_step_validate()
+            else:
+                return self._async_finish()
+        store = async_get_store(self.hass, DOMAIN)
+        await store.async_load()
+        names = {}
+        for fund, _ in current:
+            data = store.get(fund)[0]
+            names[fund] = f"{data['name']} ({fund})" if data else fund
+        return self.async_show_form(
+            step_id="init",
+            data_schema=vol.Schema(
+                {
+                    vol.Optional(CONF_ADD_FUNDS, default=""): TEXT,
+                    vol.Optional(CONF_ADD_LT_FUNDS, default=""): TEXT,
+                    vol.Optional(CONF_REMOVE, default=[]): cv.multi_select(names),
+                }
+            ),
+            errors=errors,
+            description_placeholders={"malformed": ", ".join(malformed)},
+        )
+
+    def _async_finish(self):
+        """Save the kept and the valid new funds."""
+        funds = list(self._kept) + list(self._valid)
+        return self.async_create_entry(
+            title="",
+            data={
+                **self.options,
+                CONF_FUNDS: [fund for fund, morn in funds if morn],
+                CONF_LT_FUNDS: [fund for fund, morn in funds if not morn],
+            },
+        )
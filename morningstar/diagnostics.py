@@ -0,0 +1,8 @@
+"""Diagnostics support for Morningstar."""
+from ..fund_engine.metrics import async_get_metrics
+from .sensor import DOMAIN
+
+
+async def async_get_config_entry_diagnostics(hass, entry) -> dict:
+    """Return the fetch and parse metrics of every source and fund."""
+    return async_get_metrics(hass, DOMAIN).as_dict()
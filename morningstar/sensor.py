@@ -2,55 +2,98 @@
 import asyncio
 import logging
 from datetime import timedelta
+from functools import partial
 
-import aiohttp
-import async_timeout
 import voluptuous as vol
 from bs4 import BeautifulSoup
 
 import homeassistant.helpers.config_validation as cv
 from homeassistant.components.sensor import PLATFORM_SCHEMA
-from homeassistant.const import ATTR_ATTRIBUTION, CONF_CURRENCY, CONF_SCAN_INTERVAL
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.const import (
+    ATTR_ATTRIBUTION,
+    CONF_CURRENCY,
+    CONF_SCAN_INTERVAL,
+    EVENT_HOMEASSISTANT_STOP,
+)
+from homeassistant.core import callback
+from homeassistant.helpers import entity_registry as er
 from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.update_coordinator import CoordinatorEntity, UpdateFailed
+
+from ..fund_engine.cache import ResponseCache
+from ..fund_engine.coordinator import FundCoordinator
+from ..fund_engine.engine import ParsePool, StreamEnd, async_get_engine, trend_icon
+from ..fund_engine.history import async_get_history, async_register_get_history
+from ..fund_engine.metrics import async_get_metrics
+from ..fund_engine.numeric import numeric_attributes, to_float
+from ..fund_engine.pages import (
+    ATTRIBUTION,
+    DEFAULT_PARSER,
+    PARSERS,
+    LtSource,
+    SnapshotSource,
+    sections,
+)
+from ..fund_engine.store import async_get_store
 
 _LOGGER = logging.getLogger(__name__)
 
-ATTRIBUTION = "Data provided by Morningstar"
+CONF_ADAPTIVE = "adaptive_scan_interval"
+CONF_DIAGNOSTICS = "diagnostics"
 CONF_FUNDS = "funds"
 CONF_LT_FUNDS = "lt_funds"
+CONF_NUMERIC = "numeric"
+CONF_PARALLEL_REQUESTS = "parallel_requests"
+CONF_PARSE_ONLY = "parse_only_sections"
+CONF_PARSE_PROCESSES = "parse_processes"
+CONF_PARSE_WORKERS = "parse_workers"
+CONF_PARSER = "parser"
+CONF_SETUP_TIMEOUT = "setup_timeout"
+CONF_STREAMING = "streaming"
+DEFAULT_PARALLEL_REQUESTS = 5
+DEFAULT_PARSE_WORKERS = 2
 DEFAULT_SCAN_INTERVAL = timedelta(minutes=30)
+DEFAULT_SETUP_TIMEOUT = timedelta(seconds=30)
 DOMAIN = "morningstar"
+URL = "https://www.morningstar.no/no/funds/snapshot/snapshot.aspx?id={}"
 
-PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
+OPTIONS_SCHEMA = vol.Schema(
     {
         # Figure out a way to require only one, but both can be used simultanoiusly
         vol.Optional(CONF_FUNDS): vol.All(cv.ensure_list, [cv.string]),
         vol.Optional(CONF_LT_FUNDS): vol.All(cv.ensure_list, [cv.string]),
         vol.Optional(CONF_CURRENCY, default="0"): cv.string,
         vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL): cv.time_period,
+        vol.Optional(
+            CONF_PARALLEL_REQUESTS, default=DEFAULT_PARALLEL_REQUESTS
+        ): cv.positive_int,
+        vol.Optional(CONF_SETUP_TIMEOUT, default=DEFAULT_SETUP_TIMEOUT): cv.time_period,
+        vol.Optional(CONF_PARSER, default=DEFAULT_PARSER): vol.In(PARSERS),
+        vol.Optional(CONF_PARSE_ONLY, default=True): cv.boolean,
+        vol.Optional(CONF_STREAMING, default=True): cv.boolean,
+        vol.Optional(CONF_PARSE_WORKERS, default=DEFAULT_PARSE_WORKERS): cv.positive_int,
+        vol.Optional(CONF_PARSE_PROCESSES, default=False): cv.boolean,
+        vol.Optional(CONF_ADAPTIVE, default=True): cv.boolean,
+        vol.Optional(CONF_NUMERIC, default=False): cv.boolean,
+        vol.Optional(CONF_DIAGNOSTICS, default=False): cv.boolean,
     }
 )
+PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(OPTIONS_SCHEMA.schema)
 
-
-async def async_scrape(session: object, fund: str, url: str) -> BeautifulSoup:
-    """Download data from Morningstar and parse it with BeautifulSoup."""
-    try:
-        with async_timeout.timeout(10):
-            response = await session.get(url.format(fund))
-    except (asyncio.TimeoutError, aiohttp.ClientError):
-        _LOGGER.warning("Unable to scrape data for %s", fund)
-        return None
-    html = await response.text()
-    _LOGGER.info("Response from Morningstar for %s: %s", fund, response.status)
-    return BeautifulSoup(html, "html.parser")
+MORNINGSTAR_SECTIONS = sections(
+    classes={"overviewKeyStatsTable", "overviewTrailingReturnsTable"}
+)
+# The same sections as they close in the page source, to stop reading there
+MORNINGSTAR_END = StreamEnd(
+    ("<h1", "</h1>"),
+    ("overviewKeyStatsTable", "</table>"),
+    ("overviewTrailingReturnsTable", "</table>"),
+)
 
 
-async def async_morningstar(session: object, fund: str) -> dict:
-    """Initiate the scraper and process the data."""
-    url = "https://www.morningstar.no/no/funds/snapshot/snapshot.aspx?id={}"
+def parse_morningstar(soup: BeautifulSoup, fund: str, url: str) -> dict:
+    """Extract the fund data from a Morningstar snapshot page."""
     try:
-        soup = await async_scrape(session, fund, url)
         name = soup.h1.text
         keys = soup.find("table", attrs={"class": "overviewKeyStatsTable"})
         hist = soup.find("table", attrs={"class": "overviewTrailingReturnsTable"})
@@ -62,13 +105,7 @@ async def async_morningstar(session: object, fund: str) -> dict:
             .text.replace(",", ".")
             .replace("%\n", "")
         )
-        icon = (
-            "mdi:trending-up"
-            if oday > 0
-            else "mdi:trending-down"
-            if oday < 0
-            else "mdi:trending-neutral"
-        )
+        icon = trend_icon(oday)
         attr = {ATTR_ATTRIBUTION: ATTRIBUTION, "Dato": date, "1 dag": f"{oday:.2f} %"}
         hist = [[td.text for td in tr.select("td")] for tr in hist.select("tr")][1:]
         hist = {
@@ -77,74 +114,323 @@ async def async_morningstar(session: object, fund: str) -> dict:
             if item[1] != "-"
         }
         attr.update(hist)
-        attr["URL"] = url.format(fund)
+        attr["URL"] = url
         _LOGGER.info("%s successfully scraped from Morningstar", name)
         return {"name": name, "stat": stat, "unit": unit, "icon": icon, "attr": attr}
-    except AttributeError:
+    except (IndexError, AttributeError, ValueError):
         _LOGGER.warning("Unable to extract data from Morningstar for %s", fund)
         return None
 
 
-async def async_morningstar_lt(session: object, fund: str) -> dict:
-    """Initiate the scraper and process the data."""
-    url = "https://lt.morningstar.com/cahq7idbwv/snapshot/snapshot.aspx?id={}"
+class MorningstarCoordinator(FundCoordinator):
+    """Refresh every configured fund in one scheduled cycle.
+
+    The funds are (fund, morn) pairs, morn telling Morningstar funds from
+    Morningstar LT funds.
+    """
+
+    def __init__(
+        self,
+        hass,
+        funds,
+        lt_funds,
+        parallel_requests,
+        update_interval,
+        pool: ParsePool,
+        sources: dict,
+        adaptive=True,
+        store=None,
+        history=None,
+        metrics=None,
+    ):
+        super().__init__(
+            hass,
+            _LOGGER,
+            DOMAIN,
+            [(fund, True) for fund in funds] + [(fund, False) for fund in lt_funds],
+            update_interval,
+            adaptive,
+            store,
+            history,
+            metrics,
+        )
+        self.engine = async_get_engine(hass)
+        self.pool = pool
+        self.sources = sources
+        self.cache = ResponseCache()
+        self._semaphore = asyncio.Semaphore(parallel_requests)
+
+    def key(self, fund: tuple) -> str:
+        """Return the id of a (fund, morn) pair."""
+        return fund[0]
+
+    def nav(self, data: dict) -> str:
+        """Return the NAV of a fund."""
+        return data["stat"]
+
+    def nav_date(self, data: dict) -> str:
+        """Return the date of the NAV of a fund."""
+        return data["attr"].get("Dato")
+
+    async def _async_fetch(self, fund: tuple) -> dict:
+        """Fetch a single fund, bounded by the semaphore."""
+        fund_id, morn = fund
+        async with self._semaphore:
+            return await self.engine.async_fetch(
+                self.sources[morn], fund_id, self.pool, self.cache, self.metrics
+            )
+
+    async def async_add_funds(self, funds: list, timeout: float = None):
+        """Start refreshing more funds, without refreshing the others."""
+        self.funds += funds
+        data = {**(self.data or {}), **await self.async_load_stored(funds)}
+        self.data = data
+        missing = [(fund, morn) for fund, morn in funds if fund not in data]
+        if missing:
+            self.data = await self.async_fetch_all(missing, timeout)
+
+    @callback
+    def async_remove_funds(self, funds: set):
+        """Stop refreshing funds and forget their data."""
+        self.funds = [(fund, morn) for fund, morn in self.funds if fund not in funds]
+        self.data = {
+            fund: data for fund, data in (self.data or {}).items() if fund not in funds
+        }
+        for fund in funds:
+            self.stale.pop(fund, None)
+            self.fetched.pop(fund, None)
+            if self.schedule is not None:
+                self.schedule.forget(fund)
+
+    async def _async_update_data(self) -> dict:
+        """Refresh all funds."""
+        data = await self.async_fetch_all()
+        if self.funds and not data:
+            raise UpdateFailed("No data received from Morningstar")
+        _LOGGER.debug(
+            "Parsed %s pages, skipped %s unchanged pages and %s state writes",
+            self.cache.parses,
+            self.cache.parses_skipped,
+            self.cache.writes_skipped,
+        )
+        return data
+
+
+def _sources(config: dict) -> dict:
+    """Return the Morningstar and Morningstar LT sources, by whether a fund is LT."""
+    return {
+        True: SnapshotSource(
+            URL,
+            parse_morningstar,
+            MORNINGSTAR_SECTIONS,
+            config[CONF_PARSER],
+            config[CONF_PARSE_ONLY],
+            stream_end=MORNINGSTAR_END if config[CONF_STREAMING] else None,
+        ),
+        False: LtSource(
+            config[CONF_PARSER], config[CONF_PARSE_ONLY], config[CONF_STREAMING]
+        ),
+    }
+
+
+async def async_validate_funds(hass, funds: list) -> dict:
+    """Fetch new funds concurrently, returning the names of those that exist.
+
+    funds holds (fund, morn) pairs, as in the coordinator. The sources have
+    the default options, as config entries do, so the engine shares their
+    results with the coordinator of the entry for RESULT_TTL seconds, and
+    sensors added right after don't fetch again.
+    """
+    engine = async_get_engine(hass)
+    sources = _sources(OPTIONS_SCHEMA({}))
+    pool = ParsePool(DEFAULT_PARSE_WORKERS, DOMAIN)
+    cache = ResponseCache()
+    semaphore = asyncio.Semaphore(DEFAULT_PARALLEL_REQUESTS)
+
+    async def validate(fund: str, morn: bool) -> dict:
+        async with semaphore:
+            return await engine.async_fetch(sources[morn], fund, pool, cache)
+
     try:
-        soup = await async_scrape(session, fund, url)
-        name = soup.h1.text
-        stat = soup.select("#KeyStatsLatestNav td")[0].text[4:].replace(",", ".")
-        unit = soup.select("#KeyStatsLatestNav td")[0].text[:3]
-        pcts = soup.select("#TrailingReturns > table > tbody > tr > td.colSecurity")
-        span = soup.select("#TrailingReturns > table > tbody > tr > th")
-        date = soup.select("#KeyStatsLatestNav > th > span")[0].text
-        oday = float(pcts[1].text.replace(",", "."))
-        icon = (
-            "mdi:trending-up"
-            if oday > 0
-            else "mdi:trending-down"
-            if oday < 0
-            else "mdi:trending-neutral"
+        results = await asyncio.gather(
+            *(validate(fund, morn) for fund, morn in funds), return_exceptions=True
         )
-        attr = {ATTR_ATTRIBUTION: ATTRIBUTION, "Dato": date}
-        hist = {span[i].text: pcts[i].text + " %" for i in range(len(pcts))}
-        attr.update(hist)
-        attr["URL"] = url.format(fund)
-        _LOGGER.info("%s successfully scraped from Morningstar LT", name)
-        return {"name": name, "stat": stat, "unit": unit, "icon": icon, "attr": attr}
-    except (IndexError, AttributeError):
-        _LOGGER.warning("Unable to extract data from Morningstar LT for %s", fund)
-        return None
+    finally:
+        pool.shutdown()
+    return {
+        (fund, morn): data["name"]
+        for (fund, morn), data in zip(funds, results)
+        if data and not isinstance(data, Exception)
+    }
+
+
+async def _async_setup_coordinator(hass, config: dict) -> MorningstarCoordinator:
+    """Create the coordinator of a configuration and fetch its first data."""
+    coordinator = MorningstarCoordinator(
+        hass,
+        config.get(CONF_FUNDS, []),
+        config.get(CONF_LT_FUNDS, []),
+        config[CONF_PARALLEL_REQUESTS],
+        config[CONF_SCAN_INTERVAL],
+        ParsePool(config[CONF_PARSE_WORKERS], DOMAIN, config[CONF_PARSE_PROCESSES]),
+        _sources(config),
+        config[CONF_ADAPTIVE],
+        async_get_store(hass, DOMAIN),
+        async_get_history(hass, DOMAIN),
+        async_get_metrics(hass, DOMAIN),
+    )
+    async_register_get_history(hass, DOMAIN, coordinator.history)
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, coordinator.pool.shutdown)
+    if config[CONF_DIAGNOSTICS]:
+        hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP,
+            coordinator.metrics.async_measure_writes(hass, DOMAIN),
+        )
+    await coordinator.async_start(config[CONF_SETUP_TIMEOUT].total_seconds())
+    return coordinator
+
+
+def _sensors(
+    coordinator: MorningstarCoordinator, funds: list, config: dict, scope: str
+) -> list:
+    """Return the sensors of funds, with their metrics if diagnostics are on.
+
+    scope is the config entry ID, or the domain for YAML, and keeps the unique
+    IDs of the metrics sensors of both apart.
+    """
+    unit = config.get(CONF_CURRENCY)
+    sensors = [
+        MorningstarSensor(coordinator, fund, unit, config[CONF_NUMERIC])
+        for fund in funds
+    ]
+    if config[CONF_DIAGNOSTICS]:
+        sensors += coordinator.metrics.fund_sensors(scope, funds)
+    return sensors
+
+
+def _source_sensors(
+    coordinator: MorningstarCoordinator, config: dict, scope: str
+) -> list:
+    """Return the metrics sensors of the sources, if diagnostics are on."""
+    if not config[CONF_DIAGNOSTICS]:
+        return []
+    sources = {source.name for source in coordinator.sources.values()}
+    return coordinator.metrics.source_sensors(scope, sources, "Morningstar")
 
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the Morningstar sensor."""
     _LOGGER.info("Setting up sensors")
-    session = async_get_clientsession(hass)
-    funds = config[CONF_FUNDS]
-    lt_funds = config[CONF_LT_FUNDS]
-    unit = config.get(CONF_CURRENCY)
-    entities = []
-    for fund in funds:
-        data = await async_morningstar(session, fund)
-        if data:
-            entities.append(MorningstarSensor(data, fund, unit, True))
-    for lt_fund in lt_funds:
-        data = await async_morningstar_lt(session, lt_fund)
-        if data:
-            entities.append(MorningstarSensor(data, lt_fund, unit, False))
-    async_add_entities(entities)
-
-
-class MorningstarSensor(Entity):
-    """Initiate the scraper and process the data."""
-
-    def __init__(self, data, fund, unit, morn):
-        self._attr = data["attr"]
+    coordinator = await _async_setup_coordinator(hass, config)
+    funds = [fund for fund, _ in coordinator.funds]
+    async_add_entities(
+        _sensors(coordinator, funds, config, DOMAIN)
+        + _source_sensors(coordinator, config, DOMAIN)
+    )
+
+
+async def async_setup_entry(hass, entry, async_add_entities):
+    """Set up the Morningstar sensors of a config entry."""
+    config = OPTIONS_SCHEMA(dict(entry.options))
+    coordinator = await _async_setup_coordinator(hass, config)
+    entry.async_on_unload(coordinator.pool.shutdown)
+    entry.async_on_unload(coordinator.metrics.async_stop_measuring)
+    entry.async_on_unload(
+        partial(coordinator.metrics.async_forget_sensors, entry.entry_id)
+    )
+    entry.async_on_unload(
+        entry.add_update_listener(
+            partial(_async_update_funds, coordinator, config, async_add_entities)
+        )
+    )
+    funds = [fund for fund, _ in coordinator.funds]
+    async_add_entities(
+        _sensors(coordinator, funds, config, entry.entry_id)
+        + _source_sensors(coordinator, config, entry.entry_id)
+    )
+
+
+async def _async_update_funds(
+    coordinator: MorningstarCoordinator, config: dict, async_add_entities, hass, entry
+):
+    """Add and remove the sensors of funds changed in the options.
+
+    The other sensors keep running, without being set up or fetched again.
+    """
+    options = OPTIONS_SCHEMA(dict(entry.options))
+    funds = [(fund, True) for fund in options.get(CONF_FUNDS, [])]
+    funds += [(fund, False) for fund in options.get(CONF_LT_FUNDS, [])]
+    wanted = set(funds)
+    removed = {fund for fund, morn in coordinator.funds if (fund, morn) not in wanted}
+    if removed:
+        coordinator.async_remove_funds(removed)
+        registry = er.async_get(hass)
+        for fund in removed:
+            coordinator.metrics.remove_fund(entry.entry_id, fund)
+            for unique_id in (fund, f"{entry.entry_id}_{fund}_fetch_time"):
+                entity_id = registry.async_get_entity_id("sensor", DOMAIN, unique_id)
+                entity = entity_id and registry.async_get(entity_id)
+                if entity and entity.config_entry_id == entry.entry_id:
+                    registry.async_remove(entity_id)
+        _LOGGER.info("Removed %s funds", len(removed))
+    current = set(coordinator.funds)
+    added = [item for item in funds if item not in current]
+    if added:
+        await coordinator.async_add_funds(
+            added, config[CONF_SETUP_TIMEOUT].total_seconds()
+        )
+        async_add_entities(
+            _sensors(coordinator, [fund for fund, _ in added], config, entry.entry_id)
+        )
+        _LOGGER.info("Added %s funds", len(added))
+
+
+class MorningstarSensor(CoordinatorEntity, Entity):
+    """Representation of a Morningstar fund."""
+
+    # The same for every state, no need to store them with each one
+    _unrecorded_attributes = frozenset((ATTR_ATTRIBUTION, "URL"))
+
+    def __init__(self, coordinator, fund, unit, numeric=False):
+        super().__init__(coordinator)
+        self._numeric = numeric
+        self._attr = None
+        self._icon = None
+        self._name = fund
+        self._stat = None
+        self._unit = None if unit == "0" else unit
+        self._fund = fund
+        self._data = None
+        self._stale = coordinator.stale.get(fund)
+        self._set_data(coordinator.data.get(fund))
+
+    def _set_data(self, data: dict):
+        """Store the coordinator data for this fund on the sensor."""
+        if not data:
+            return
+        self._data = data
         self._icon = data["icon"]
         self._name = data["name"]
-        self._stat = data["stat"]
-        self._unit = data["unit"] if unit == "0" else unit
-        self._fund = fund
-        self._morn = morn
+        if self._numeric:
+            self._attr = numeric_attributes(data["attr"])
+            self._stat = to_float(data["stat"])
+        else:
+            self._attr = data["attr"]
+            self._stat = data["stat"]
+        if self._unit is None:
+            self._unit = data["unit"]
+
+    @callback
+    def _handle_coordinator_update(self):
+        """Update the sensor from the coordinator, unless nothing changed."""
+        data = self.coordinator.data.get(self._fund)
+        stale = self.coordinator.stale.get(self._fund)
+        if data is self._data and stale == self._stale:
+            self.coordinator.cache.writes_skipped += 1
+            return
+        self._stale = stale
+        self._set_data(data)
+        self.async_write_ha_state()
 
     @property
     def name(self):
@@ -161,6 +447,11 @@ class MorningstarSensor(Entity):
         """Return sensor value."""
         return self._stat
 
+    @property
+    def available(self):
+        """Return True once the sensor has data."""
+        return self._data is not None
+
     @property
     def unit_of_measurement(self):
         """Return the currency for the sensor."""
@@ -173,20 +464,8 @@ class MorningstarSensor(Entity):
 
     @property
     def extra_state_attributes(self):
-        """Return the sensor attributes."""
-        return self._attr
-
-    async def async_update(self):
-        """Update sensor data."""
-        session = async_get_clientsession(self.hass)
-        if self._morn:
-            data = await async_morningstar(session, self._fund)
-        else:
-            data = await async_morningstar_lt(session, self._fund)
-        if data:
-            self._attr = data["attr"]
-            self._icon = data["icon"]
-            self._name = data["name"]
-            self._stat = data["stat"]
-        else:
-            _LOGGER.warning("Failed to update %s", self._name)
+        """Return the sensor attributes, marked while they are stale."""
+        if self._stale is None or self._attr is None:
+            return self._attr
+        return {**self._attr, "stale": True, "fetched": self._stale.isoformat()}
+
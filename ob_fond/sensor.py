@@ -1,30 +1,48 @@
+import asyncio
 from datetime import timedelta
 import json
 import logging
-import urllib.request
-import urllib.error
+import time
+import urllib.parse
 
+import aiohttp
 import voluptuous as vol
 
+from homeassistant.components import persistent_notification
 from homeassistant.components.sensor import PLATFORM_SCHEMA
 from homeassistant.const import (
-    ATTR_ATTRIBUTION,
     CONF_CURRENCY,
     # CONF_PREFIX,
-    CONF_SCAN_INTERVAL
+    CONF_SCAN_INTERVAL,
+    EVENT_HOMEASSISTANT_STOP,
 )
+from homeassistant.core import callback
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.update_coordinator import CoordinatorEntity, UpdateFailed
+
+from ..fund_engine.compact import compact
+from ..fund_engine.coordinator import FundCoordinator
+from ..fund_engine.engine import async_get_engine
+from ..fund_engine.metrics import async_get_metrics
+from ..fund_engine.store import async_get_store
+from .snapshot import STATIC_ATTRIBUTES, FundSnapshot
 
 _LOGGER = logging.getLogger(__name__)
 
+CONF_ADAPTIVE = "adaptive_scan_interval"
 CONF_FUND = "fund"
 CONF_FUNDS = "funds"
-
-ATTRIBUTION = "Fund data provided by Oslo Børs (Oslo Stock Exchange)"
+CONF_NUMERIC = "numeric"
+DOMAIN = "ob_fond"
+SOURCE = "Oslo Børs"
 
 # DEFAULT_PREFIX = "fond"
 DEFAULT_SCAN_INTERVAL = timedelta(minutes=10)
+DEFAULT_TIMEOUT = 10
+
+# Funds per API request, keeps the filter expression within URL length limits
+MAX_FUNDS_PER_REQUEST = 25
 
 FUND_SCHEMA = vol.Schema(
     {
@@ -37,72 +55,187 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     {
         vol.Required(CONF_FUNDS): vol.All(cv.ensure_list, [FUND_SCHEMA]),
         # vol.Optional(CONF_PREFIX, default=DEFAULT_PREFIX): cv.string,
-        vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL): cv.time_period
+        vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL): cv.time_period,
+        vol.Optional(CONF_ADAPTIVE, default=True): cv.boolean,
+        vol.Optional(CONF_NUMERIC, default=False): cv.boolean
     }
 )
 
 API_URL = (
-    "https://www.oslobors.no/ob/servlets/components?filter=ITEM_SECTOR==s{}&source=feed.omff.FUNDS&columns=" +
+    "https://www.oslobors.no/ob/servlets/components?filter={}&source=feed.omff.FUNDS&columns=" +
     "SECURITYNAME+as+LONG_NAME,PRICE,DATE,PRICECHANGEPCT,RET1WEEK,RET1M,RET3M,RET6M,RETY2D," +
     "RETGAVG1YR,RETGAVG2YR,RETGAVG3YR,RETGAVG4YR,RETGAVG5YR,RETGAVG7YR,RETGAVG10YR,RETGAVG20YR," +
     "MANAGEMENTFEE,MAXREDEMPTIONFEE,MAXSALECHARGE,BENCHMARKNAME,QUOTATIONCURRENCY"
 )
 
 
-def api_request(query):
-    """Setup the API query engine."""
+def parse_response(body: str) -> dict:
+    """Decode an API response, sharing the strings that repeat across funds."""
+    return compact(json.loads(body))
+
+
+async def async_api_request(engine, funds, url=API_URL, metrics=None):
+    """Request data for several funds in one API query.
+
+    The time and size of the shared request are split evenly between the
+    funds in the metrics.
+    """
+    query = "||".join(f"ITEM_SECTOR==s{fund}" for fund in funds)
+    stats = [metrics.fund(fund.upper(), SOURCE) for fund in funds] if metrics else []
+    start = time.perf_counter()
     try:
-        with urllib.request.urlopen(API_URL.format(query)) as api_response:
-            return json.loads(api_response.read())
-    except urllib.error.HTTPError:
-        _LOGGER.error("HTTP Error requesting %s, please check spelling.", query)
-        return
+        status, _, body = await engine.async_request(
+            "GET", url.format(urllib.parse.quote(query)), DEFAULT_TIMEOUT
+        )
+        fetch_time = time.perf_counter() - start
+        for fund_stats in stats:
+            fund_stats.fetched(fetch_time / len(funds), len(body.encode()) // len(funds))
+        if status < 400:
+            start = time.perf_counter()
+            data = parse_response(body)
+            parse_time = time.perf_counter() - start
+            for fund_stats in stats:
+                fund_stats.parsed(parse_time / len(funds))
+            return data
+        _LOGGER.error("HTTP Error requesting %s, please check spelling.", ", ".join(funds))
+    except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as err:
+        _LOGGER.warning("Unable to request data for %s", ", ".join(funds))
+        for fund_stats in stats:
+            fund_stats.failed(isinstance(err, asyncio.TimeoutError))
+        return None
+    for fund_stats in stats:
+        fund_stats.failed()
+    return None
+
+
+class OBFondCoordinator(FundCoordinator):
+    """Fetch all configured funds in as few API requests as possible."""
+
+    def __init__(self, hass, funds, update_interval, adaptive=True, store=None, metrics=None):
+        super().__init__(
+            hass, _LOGGER, DOMAIN, funds, update_interval, adaptive, store, metrics=metrics
+        )
+        self._engine = async_get_engine(hass)
+
+    def key(self, fund):
+        """Return the key of the rows of a fund."""
+        return fund.upper()
+
+    def nav(self, row):
+        """Return the price in the row of a fund."""
+        return row["values"].get("PRICE")
 
+    def nav_date(self, row):
+        """Return the date of the price in the row of a fund."""
+        return row["values"]["DATE"]
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+    async def async_fetch_all(self, funds=None, timeout=None):
+        """Request the funds, all of them by default, and index the returned rows by key."""
+        funds = self.funds if funds is None else funds
+        chunks = [
+            funds[index:index + MAX_FUNDS_PER_REQUEST]
+            for index in range(0, len(funds), MAX_FUNDS_PER_REQUEST)
+        ]
+        responses = await asyncio.gather(
+            *(async_api_request(self._engine, chunk, metrics=self.metrics) for chunk in chunks),
+            return_exceptions=True,
+        )
+        received = {}
+        for api_data in responses:
+            if isinstance(api_data, Exception):
+                _LOGGER.error("Unexpected error requesting funds", exc_info=api_data)
+                continue
+            for row in (api_data or {}).get("rows", []):
+                received[row["key"].upper()] = row
+        rows = dict(self.data or {})
+        await self.async_merge(
+            rows, {self.key(fund): received.get(self.key(fund)) for fund in funds}
+        )
+        self._plan_next_refresh(rows)
+        return rows
+
+    async def _async_update_data(self):
+        """Request all funds, keeping the last good rows of those missing."""
+        rows = await self.async_fetch_all()
+        if not rows:
+            raise UpdateFailed("No data received from Oslo Børs")
+        _LOGGER.debug("Received data for %s of %s funds", len(rows), len(self.funds))
+        if self.metrics is not None:
+            _LOGGER.debug("Metrics: %s", self.metrics.source(SOURCE).as_dict())
+            if self.metrics.recorder is not None:
+                _LOGGER.debug("Recorder writes: %s", self.metrics.recorder.as_dict())
+        return rows
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Setup the OB_Fond component. """
     funds = config.get(CONF_FUNDS, [])
 
     if not funds:
         err_msg = "No funds configured."
-        hass.component.persistent_notification.create(err_msg, "Sensor ob_fond")
+        persistent_notification.async_create(hass, err_msg, "Sensor ob_fond")
         _LOGGER.warning(err_msg)
         return
 
-    sensors = []
+    valid = []
     for fund in funds:
-        try:
-            _LOGGER.debug("Configuring fund %s", fund[CONF_FUND])
-            if " " not in fund[CONF_FUND]:
-                if api_request(fund[CONF_FUND]):
-                    sensors.append(OBFondSensor(fund))
-            else:
-                _LOGGER.error("Values for 'fund:' can not contain spaces, found '%s'", fund[CONF_FUND])
-        except ValueError:
+        _LOGGER.debug("Configuring fund %s", fund[CONF_FUND])
+        if " " not in fund[CONF_FUND]:
+            valid.append(fund)
+        else:
+            _LOGGER.error("Values for 'fund:' can not contain spaces, found '%s'", fund[CONF_FUND])
+
+    coordinator = OBFondCoordinator(
+        hass,
+        [fund[CONF_FUND] for fund in valid],
+        config[CONF_SCAN_INTERVAL],
+        config[CONF_ADAPTIVE],
+        async_get_store(hass, DOMAIN),
+        async_get_metrics(hass, DOMAIN)
+    )
+    if _LOGGER.isEnabledFor(logging.DEBUG):
+        hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP,
+            coordinator.metrics.async_measure_writes(hass, DOMAIN),
+        )
+    await coordinator.async_start()
+
+    sensors = []
+    for fund in valid:
+        if fund[CONF_FUND].upper() in (coordinator.data or {}):
+            sensors.append(OBFondSensor(coordinator, fund, config[CONF_NUMERIC]))
+        else:
             _LOGGER.error("Error loading fund %s, please check config", fund[CONF_FUND])
 
-    add_entities(sensors, True)
+    async_add_entities(sensors)
     _LOGGER.info("Setup of funds complete")
 
 
-class OBFondSensor(Entity):
+class OBFondSensor(CoordinatorEntity, Entity):
     """Representation of a Oslo Børs Fond sensor."""
 
-    def __init__(self, fund):
+    _unrecorded_attributes = STATIC_ATTRIBUTES
+
+    def __init__(self, coordinator, fund, numeric=False):
+        super().__init__(coordinator)
         self._fund = fund[CONF_FUND]
+        self._key = self._fund.upper()
         # self._prefix = config.get(CONF_PREFIX)
         self._unit_of_measurement = fund.get(CONF_CURRENCY, "kr")
-        self._api_data = None
+        self._numeric = numeric
+        self._snapshot = FundSnapshot(
+            coordinator.data[self._key], coordinator.stale.get(self._key), numeric
+        )
 
     @property
     def name(self):
         """Return the name of the sensor."""
-        return self._api_data["rows"][0]["values"]["LONG_NAME"]
+        return self._snapshot.name
 
     @property
     def unique_id(self):
         """Return the unique ID."""
-        return self._api_data["rows"][0]["key"]
+        return self._snapshot.unique_id
 
     @property
     def unit_of_measurement(self):
@@ -112,56 +245,25 @@ class OBFondSensor(Entity):
     @property
     def state_attributes(self):
         """Return the state attributes."""
-        osedate = self._api_data["rows"][0]["values"]["DATE"]
-        date = f"{osedate[6:8]}.{osedate[4:6]}.{osedate[0:4]}"
-
-        attributes = {
-            ATTR_ATTRIBUTION: ATTRIBUTION,
-            "Dato": date,
-            "Forvaltningshonorar": str(self._api_data["rows"][0]["values"]["MANAGEMENTFEE"]) + " %",
-            "Kjøpsavgift": str(self._api_data["rows"][0]["values"]["MAXREDEMPTIONFEE"]) + " %",
-            "Salgsavgift": str(self._api_data["rows"][0]["values"]["MAXSALECHARGE"]) + " %",
-            "Referanseindeks": self._api_data["rows"][0]["values"]["BENCHMARKNAME"],
-            "Intradag": str(self._api_data["rows"][0]["values"]["PRICECHANGEPCT"]) + " %"
-        }
-
-        apikeys = (
-            "RET1WEEK", "RET1M", "RET3M", "RET6M", "RETY2D", "RETGAVG1YR", "RETGAVG2YR",
-            "RETGAVG3YR", "RETGAVG4YR", "RETGAVG5YR", "RETGAVG7YR", "RETGAVG10YR", "RETGAVG20YR"
-            )
-        attr = (
-            "Uke", "Måned", "3 Måneder", "6 Måneder", "Hittil i år",
-            "1 år", "2 år", "3 år", "4 år", "5 år", "7 år", "10 år", "20 år"
-            )
-
-        for index, data in enumerate(apikeys):
-            if self._api_data["rows"][0]["values"][data]:
-                attributes[attr[index]] = str(self._api_data["rows"][0]["values"][data]) + " %"
-
-        return attributes
+        return self._snapshot.attributes
 
     @property
     def state(self):
         """Return the state of the device."""
-        return round(self._api_data["rows"][0]["values"]["PRICE"], 2)
+        return self._snapshot.state
 
     @property
     def icon(self):
         """Return icon to use based on preformance."""
-        iconvalue = self._api_data["rows"][0]["values"]["PRICECHANGEPCT"]
-        if iconvalue > 0:
-            return "mdi:arrow-top-right-thick"
-        elif iconvalue < 0:
-            return "mdi:arrow-bottom-right-thick"
-        elif iconvalue == 0:
-            return "mdi:arrow-right-thick"
-        else:
-            return "mdi:alert-circle"
-
-    def update(self):
-        _LOGGER.debug("Requesting new data for %s", self._fund)
-        api_data = api_request(self._fund)
-        self._api_data = api_data
-        _LOGGER.info(
-            "Data updated for fund %s (%s)", self._fund, self._api_data["rows"][0]["values"]["LONG_NAME"]
-            )
+        return self._snapshot.icon
+
+    @callback
+    def _handle_coordinator_update(self):
+        """Update the sensor from the coordinator, unless nothing changed."""
+        row = self.coordinator.data.get(self._key, self._snapshot.row)
+        fetched = self.coordinator.stale.get(self._key)
+        if self._snapshot.matches(row, fetched):
+            return
+        self._snapshot = FundSnapshot(row, fetched, self._numeric)
+        _LOGGER.info("Data updated for fund %s (%s)", self._fund, self._snapshot.name)
+        self.async_write_ha_state()
@@ -0,0 +1,87 @@
+"""Derived sensor values of one fund, computed once per update."""
+from homeassistant.const import ATTR_ATTRIBUTION
+
+from ..fund_engine.compact import compact
+from ..fund_engine.numeric import to_float
+
+ATTRIBUTION = "Fund data provided by Oslo Børs (Oslo Stock Exchange)"
+# Attributes that rarely or never change, not worth storing with every state
+STATIC_ATTRIBUTES = frozenset(
+    (
+        ATTR_ATTRIBUTION,
+        "Forvaltningshonorar",
+        "Kjøpsavgift",
+        "Salgsavgift",
+        "Referanseindeks",
+    )
+)
+
+# API columns of the returns and the attribute names they are shown as
+RETURNS = (
+    ("RET1WEEK", "Uke"),
+    ("RET1M", "Måned"),
+    ("RET3M", "3 Måneder"),
+    ("RET6M", "6 Måneder"),
+    ("RETY2D", "Hittil i år"),
+    ("RETGAVG1YR", "1 år"),
+    ("RETGAVG2YR", "2 år"),
+    ("RETGAVG3YR", "3 år"),
+    ("RETGAVG4YR", "4 år"),
+    ("RETGAVG5YR", "5 år"),
+    ("RETGAVG7YR", "7 år"),
+    ("RETGAVG10YR", "10 år"),
+    ("RETGAVG20YR", "20 år"),
+)
+
+
+def _icon(change) -> str:
+    """Return the icon for the intraday change."""
+    if not isinstance(change, (int, float)):
+        return "mdi:alert-circle"
+    if change > 0:
+        return "mdi:arrow-top-right-thick"
+    if change < 0:
+        return "mdi:arrow-bottom-right-thick"
+    return "mdi:arrow-right-thick"
+
+
+def _attributes(values: dict, numeric: bool) -> dict:
+    """Build the state attributes of a fund from its API values."""
+    percent = to_float if numeric else "{} %".format
+    osedate = values["DATE"]
+    attributes = {
+        ATTR_ATTRIBUTION: ATTRIBUTION,
+        "Dato": f"{osedate[6:8]}.{osedate[4:6]}.{osedate[0:4]}",
+        "Forvaltningshonorar": percent(values["MANAGEMENTFEE"]),
+        "Kjøpsavgift": percent(values["MAXREDEMPTIONFEE"]),
+        "Salgsavgift": percent(values["MAXSALECHARGE"]),
+        "Referanseindeks": values["BENCHMARKNAME"],
+        "Intradag": percent(values["PRICECHANGEPCT"]),
+    }
+    for column, name in RETURNS:
+        if values[column]:
+            attributes[name] = percent(values[column])
+    return attributes
+
+
+class FundSnapshot:
+    """Name, state, icon and attributes of a fund row, served without lookups."""
+
+    __slots__ = ("row", "fetched", "name", "unique_id", "state", "icon", "attributes")
+
+    def __init__(self, row: dict, fetched=None, numeric: bool = False):
+        values = row["values"]
+        self.row = row
+        self.fetched = fetched
+        self.name = values["LONG_NAME"]
+        self.unique_id = row["key"]
+        self.state = round(values["PRICE"], 2)
+        self.icon = _icon(values["PRICECHANGEPCT"])
+        self.attributes = compact(_attributes(values, numeric))
+        if fetched is not None:
+            self.attributes["stale"] = True
+            self.attributes["fetched"] = fetched.isoformat()
+
+    def matches(self, row: dict, fetched) -> bool:
+        """Return True if the snapshot was built from the same data."""
+        return fetched == self.fetched and (row is self.row or row == self.row)
@@ -0,0 +1,14 @@
+"""Load the integrations as a package, the way Home Assistant loads custom_components.
+
+The integrations import the shared fund_engine relatively, so the tests import
+them as custom_components.<integration>, as benchmarks/run.py does.
+"""
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "custom_components"
+if PACKAGE not in sys.modules:
+    sys.modules[PACKAGE] = types.ModuleType(PACKAGE)
+    sys.modules[PACKAGE].__path__ = [ROOT]
@@ -0,0 +1,140 @@
+"""Tests of sharing fetches between the sources every platform builds."""
+import asyncio
+import os
+from types import SimpleNamespace
+
+from custom_components.fund_engine.cache import ResponseCache
+from custom_components.fund_engine.engine import (
+    DATA_ENGINE,
+    FetchEngine,
+    ParsePool,
+    StreamEnd,
+)
+from custom_components.fund_engine.pages import LT_END, LtSource
+from custom_components.lt_morningstar import sensor as lt_morningstar
+from custom_components.morningstar import sensor as morningstar
+
+FUND = "0P0000XXXX"
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), "..", "benchmarks", "fixtures", "lt_morningstar.html"
+)
+with open(FIXTURE, encoding="utf-8") as fixture:
+    PAGE = fixture.read().replace("{fund}", FUND)
+
+
+class FakeContent:
+    def __init__(self, body: bytes):
+        self._body = body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self._body), size):
+            yield self._body[start:start + size]
+
+
+class FakeResponse:
+    status = 200
+    charset = "utf-8"
+    headers = {}
+
+    def __init__(self, body: str):
+        self._body = body
+        self.content = FakeContent(body.encode())
+
+    async def text(self):
+        return self._body
+
+    def close(self):
+        pass
+
+    async def __aenter__(self):
+        # Answer a little later, so that concurrent fetches overlap
+        await asyncio.sleep(0.01)
+        return self
+
+    async def __aexit__(self, *_):
+        return None
+
+
+class FakeSession:
+    def __init__(self):
+        self.requests = 0
+
+    def request(self, method, url, **kwargs):
+        self.requests += 1
+        return FakeResponse(PAGE)
+
+
+def morningstar_lt_source():
+    """Return the LT source a Morningstar platform builds for its own use."""
+    return morningstar._sources(morningstar.OPTIONS_SCHEMA({}))[False]
+
+
+async def fetch_all(sources: list) -> tuple:
+    session = FakeSession()
+    engine = FetchEngine(None, session=session)
+    pool = ParsePool(1, "test")
+    try:
+        results = await asyncio.gather(
+            *(
+                engine.async_fetch(source, FUND, pool, ResponseCache())
+                for source in sources
+            )
+        )
+        later = await engine.async_fetch(sources[0], FUND, pool, ResponseCache())
+    finally:
+        pool.shutdown()
+    return session, engine, results, later
+
+
+def test_platforms_share_fetches_of_the_same_fund():
+    sources = [morningstar_lt_source(), morningstar_lt_source()]
+    session, engine, results, later = asyncio.run(fetch_all(sources))
+    assert results[0]["stat"] == "31.52"
+    assert results[0] is results[1] is later
+    assert session.requests == 1
+    assert engine.coalesced == 2
+
+
+def test_integrations_share_requests_of_the_same_page():
+    sources = [morningstar_lt_source(), LtSource(name=lt_morningstar.SOURCE)]
+    session, _, results, _ = asyncio.run(fetch_all(sources))
+    assert results[0]["stat"] == "31.52"
+    assert results[0] is results[1]
+    assert session.requests == 1
+
+
+def test_sources_with_other_parse_options_fetch_on_their_own():
+    config = morningstar.OPTIONS_SCHEMA({morningstar.CONF_PARSE_ONLY: False})
+    sources = [morningstar_lt_source(), morningstar._sources(config)[False]]
+    session, _, results, _ = asyncio.run(fetch_all(sources))
+    assert results[0] == results[1]
+    assert results[0] is not results[1]
+
+
+def test_stream_ends_are_equal_by_their_sections():
+    sections = [("<h1", "</h1>"), ('id="KeyStatsLatestNav"', "</tr>")]
+    assert StreamEnd(*sections) == StreamEnd(*sections)
+    assert hash(StreamEnd(*sections)) == hash(StreamEnd(*sections))
+    assert StreamEnd(*sections) != StreamEnd(*sections[:1])
+    assert LT_END != morningstar.MORNINGSTAR_END
+
+
+def test_entries_reuse_the_fetches_of_the_validation():
+    session = FakeSession()
+    engine = FetchEngine(None, session=session)
+    hass = SimpleNamespace(data={DATA_ENGINE: engine})
+    options = morningstar.OPTIONS_SCHEMA({morningstar.CONF_LT_FUNDS: [FUND]})
+
+    async def validate_and_set_up():
+        valid = await morningstar.async_validate_funds(hass, [(FUND, False)])
+        pool = ParsePool(1, "test")
+        try:
+            source = morningstar._sources(options)[False]
+            data = await engine.async_fetch(source, FUND, pool, ResponseCache())
+        finally:
+            pool.shutdown()
+        return valid, data
+
+    valid, data = asyncio.run(validate_and_set_up())
+    assert valid == {(FUND, False): data["name"]}
+    assert session.requests == 1
@@ -0,0 +1,34 @@
+"""Tests of the bulk import of Morningstar funds."""
+from custom_components.morningstar.config_flow import parse_funds
+
+
+def test_parse_funds_separators():
+    text = "0P0000ABCD, 0p0000efgh;F00000IJKL\n0P0000MNOP  0P0000ABCD"
+    assert parse_funds(text) == (
+        ["0P0000ABCD", "0P0000EFGH", "F00000IJKL", "0P0000MNOP"],
+        [],
+    )
+
+
+def test_parse_funds_from_configuration_yaml():
+    text = """
+    funds:
+      - 0P0000ABCD  # Global index
+      - 0P0000EFGH
+    lt_funds: [F00000IJKL, F00000MNOP]
+    """
+    assert parse_funds(text) == (
+        ["0P0000ABCD", "0P0000EFGH", "F00000IJKL", "F00000MNOP"],
+        [],
+    )
+
+
+def test_parse_funds_reports_malformed_words():
+    assert parse_funds("0P0000ABCD 0P00 not-a-fund") == (
+        ["0P0000ABCD"],
+        ["0P00", "not-a-fund"],
+    )
+
+
+def test_parse_funds_empty():
+    assert parse_funds("\n  # nothing yet\n") == ([], [])
@@ -0,0 +1,69 @@
+"""Tests of when the consensus sensor refreshes its sources."""
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from homeassistant.core import State
+
+from custom_components.fund_consensus import sensor
+from custom_components.fund_engine.market import TIME_ZONE
+
+SOURCES = ["sensor.fund_morningstar", "sensor.fund_euronext"]
+
+
+class FakeStates:
+    def __init__(self):
+        self.states = {}
+
+    def get(self, entity_id):
+        return self.states.get(entity_id)
+
+    def set(self, entity_id, value, day):
+        self.states[entity_id] = State(entity_id, value, {"Dato": day})
+
+
+@pytest.fixture
+def consensus(monkeypatch):
+    """Return the sensor, the clock and the sources refreshed so far."""
+    states = FakeStates()
+    for source in SOURCES:
+        states.set(source, "100.0", "15.03.2024")
+    clock = SimpleNamespace(now=datetime(2024, 3, 16, 12, tzinfo=TIME_ZONE))
+    refreshed = []
+
+    async def refresh(source):
+        refreshed.append(source)
+        return True
+
+    monkeypatch.setattr(sensor.dt_util, "now", lambda *_: clock.now)
+    entity = sensor.FundConsensusSensor("Fund", SOURCES, timedelta(minutes=30))
+    entity.hass = SimpleNamespace(states=states, async_create_task=asyncio.ensure_future)
+    monkeypatch.setattr(entity, "_async_refresh", refresh)
+    return entity, clock, refreshed
+
+
+def update(entity, clock, when: datetime):
+    clock.now = when
+    asyncio.run(entity.async_update())
+
+
+def test_sources_are_not_refreshed_on_weekends(consensus):
+    entity, clock, refreshed = consensus
+    update(entity, clock, datetime(2024, 3, 16, 12, tzinfo=TIME_ZONE))
+    assert refreshed == SOURCES[:1]
+    for hour in range(13, 24):
+        update(entity, clock, datetime(2024, 3, 16, hour, tzinfo=TIME_ZONE))
+        update(entity, clock, datetime(2024, 3, 17, hour, tzinfo=TIME_ZONE))
+    assert refreshed == SOURCES[:1]
+    assert entity.state == "100.0"
+
+
+def test_sources_are_refreshed_when_the_next_nav_is_due(consensus):
+    entity, clock, refreshed = consensus
+    update(entity, clock, datetime(2024, 3, 16, 12, tzinfo=TIME_ZONE))
+    update(entity, clock, datetime(2024, 3, 18, 12, tzinfo=TIME_ZONE))
+    assert len(refreshed) == 1
+    update(entity, clock, datetime(2024, 3, 18, 17, tzinfo=TIME_ZONE))
+    assert len(refreshed) == 2
@@ -0,0 +1,107 @@
+"""Tests of the shared fund coordinator and the diagnostic sensors of the metrics."""
+import asyncio
+from datetime import timedelta
+import logging
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.fund_engine.coordinator import FundCoordinator
+from custom_components.fund_engine.metrics import Metrics
+
+FUNDS = ["A", "B"]
+
+
+class FakeCoordinator(FundCoordinator):
+    """Return the queued results of each fund, raising those that are errors."""
+
+    def __init__(self, hass, results: dict):
+        super().__init__(
+            hass, logging.getLogger(__name__), "test", FUNDS, timedelta(minutes=5)
+        )
+        self.results = results
+
+    def nav(self, data):
+        return data["stat"]
+
+    def nav_date(self, data):
+        return data["date"]
+
+    async def _async_fetch(self, fund):
+        result = self.results[fund]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def fetch_twice(first: dict, second: dict) -> tuple:
+    """Fetch all funds with the first results, then with the second."""
+
+    async def run():
+        hass = HomeAssistant("/tmp")
+        coordinator = FakeCoordinator(hass, first)
+        coordinator.data = await coordinator.async_fetch_all()
+        before = dict(coordinator.data)
+        coordinator.results = second
+        after = await coordinator.async_fetch_all()
+        await hass.async_stop(force=True)
+        return coordinator, before, after
+
+    return asyncio.run(run())
+
+
+def data(stat: str) -> dict:
+    return {"stat": stat, "date": "15.03.2024"}
+
+
+def test_failed_funds_keep_their_last_data_marked_as_stale():
+    coordinator, before, after = fetch_twice(
+        {"A": data("1.0"), "B": data("2.0")}, {"A": data("1.1"), "B": None}
+    )
+    assert after == {"A": data("1.1"), "B": data("2.0")}
+    assert "A" not in coordinator.stale
+    assert coordinator.stale["B"] == coordinator.fetched["B"]
+
+
+def test_unexpected_errors_only_fail_their_fund():
+    coordinator, _, after = fetch_twice(
+        {"A": data("1.0"), "B": data("2.0")},
+        {"A": data("1.1"), "B": RuntimeError("boom")},
+    )
+    assert after["A"] == data("1.1")
+    assert "B" in coordinator.stale
+
+
+def test_equal_results_keep_the_data_sensors_have():
+    first = {"A": data("1.0"), "B": data("2.0")}
+    _, before, after = fetch_twice(first, {"A": data("1.0"), "B": data("2.1")})
+    assert after["A"] is before["A"]
+    assert after["B"] is not before["B"]
+
+
+def test_funds_without_data_are_not_marked_stale():
+    coordinator, _, after = fetch_twice(
+        {"A": data("1.0"), "B": None}, {"A": data("1.0"), "B": None}
+    )
+    assert "B" not in after
+    assert "B" not in coordinator.stale
+
+
+def test_metrics_sensors_are_added_once_per_scope():
+    metrics = Metrics()
+    assert len(metrics.fund_sensors("entry", FUNDS)) == 2
+    assert metrics.fund_sensors("entry", FUNDS) == []
+    assert len(metrics.fund_sensors("other", FUNDS[:1])) == 1
+    sensors = metrics.source_sensors("entry", ["Source"], "Source")
+    assert len(sensors) == 2
+    assert metrics.source_sensors("entry", ["Source"], "Source") == []
+
+
+def test_forgotten_sensors_are_added_again():
+    metrics = Metrics()
+    metrics.fund_sensors("entry", FUNDS)
+    metrics.remove_fund("entry", "A")
+    assert [sensor.unique_id for sensor in metrics.fund_sensors("entry", FUNDS)] == [
+        "entry_A_fetch_time"
+    ]
+    metrics.async_forget_sensors("entry")
+    assert len(metrics.fund_sensors("entry", FUNDS)) == 2
@@ -0,0 +1,56 @@
+"""Tests of the compact NAV history."""
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+from custom_components.fund_engine.history import HistoryStore, NavHistory
+
+DAYS = [date(2024, 3, day) for day in (11, 12, 13, 14, 15)]
+NAVS = [100.0, 101.5, 99.25, 102.0, 103.75]
+
+
+def history() -> NavHistory:
+    nav_history = NavHistory()
+    for day, nav in zip(DAYS, NAVS):
+        nav_history.append(day, nav)
+    return nav_history
+
+
+def test_round_trip():
+    restored = NavHistory.from_bytes(history().to_bytes())
+    assert restored.range() == list(zip(DAYS, NAVS))
+
+
+def test_round_trip_empty():
+    assert NavHistory.from_bytes(NavHistory().to_bytes()).range() == []
+
+
+def test_range_is_inclusive():
+    assert history().range(DAYS[1], DAYS[3]) == list(zip(DAYS[1:4], NAVS[1:4]))
+    assert history().range(start=DAYS[3]) == list(zip(DAYS[3:], NAVS[3:]))
+    assert history().range(end=DAYS[0]) == [(DAYS[0], NAVS[0])]
+    assert history().range(date(2024, 3, 16)) == []
+
+
+def test_append_replaces_the_last_day_and_ignores_older_days():
+    nav_history = history()
+    assert not nav_history.append(DAYS[-1], NAVS[-1])
+    assert nav_history.append(DAYS[-1], 104.0)
+    assert not nav_history.append(DAYS[0], 1.0)
+    assert nav_history.range(DAYS[-2]) == [(DAYS[-2], NAVS[-2]), (DAYS[-1], 104.0)]
+
+
+@pytest.mark.parametrize("cut", [1, 8, 12])
+def test_from_bytes_rejects_cut_data(cut):
+    with pytest.raises(ValueError):
+        NavHistory.from_bytes(history().to_bytes()[:-cut])
+
+
+def test_store_reads_a_cut_file_as_empty(tmp_path):
+    hass = SimpleNamespace(config=SimpleNamespace(path=lambda *parts: str(tmp_path)))
+    store = HistoryStore(hass, "test")
+    store._save("FUND", history().to_bytes()[:-12])
+    assert store._load("FUND").range() == []
+    store._save("FUND", history().to_bytes())
+    assert store._load("FUND").range() == list(zip(DAYS, NAVS))
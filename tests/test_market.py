@@ -0,0 +1,95 @@
+"""Tests of the Oslo market calendar and the NAV publish schedule."""
+from datetime import date, datetime, time, timedelta
+
+from custom_components.fund_engine.market import (
+    DEFAULT_PUBLISH_OFFSET,
+    OVERDUE_INTERVAL,
+    PUBLISH_WINDOW,
+    TIME_ZONE,
+    PublishSchedule,
+    is_open,
+    next_trading_day,
+    parse_date,
+)
+
+OPENS = time(8)
+CLOSES = time(23)
+SCAN_INTERVAL = timedelta(minutes=30)
+
+
+def oslo(*args) -> datetime:
+    return datetime(*args, tzinfo=TIME_ZONE)
+
+
+def test_is_open_on_trading_days_between_the_hours():
+    assert is_open(oslo(2024, 3, 14, 12), OPENS, CLOSES)
+    assert not is_open(oslo(2024, 3, 14, 7, 59), OPENS, CLOSES)
+    assert not is_open(oslo(2024, 3, 14, 23), OPENS, CLOSES)
+
+
+def test_is_closed_on_weekends_and_holidays():
+    assert not is_open(oslo(2024, 3, 16, 12), OPENS, CLOSES)
+    # Maundy Thursday, Good Friday and Easter Monday
+    for day in (28, 29):
+        assert not is_open(oslo(2024, 3, day, 12), OPENS, CLOSES)
+    assert not is_open(oslo(2024, 4, 1, 12), OPENS, CLOSES)
+    assert not is_open(oslo(2024, 5, 17, 12), OPENS, CLOSES)
+    assert not is_open(oslo(2024, 12, 24, 12), OPENS, CLOSES)
+
+
+def test_is_open_in_oslo_time():
+    # Oslo is an hour ahead of UTC in March
+    assert not is_open(datetime.fromisoformat("2024-03-14T06:30+00:00"), OPENS, CLOSES)
+    assert is_open(datetime.fromisoformat("2024-03-14T07:30+00:00"), OPENS, CLOSES)
+
+
+def test_next_trading_day_skips_weekends_and_holidays():
+    assert next_trading_day(date(2024, 3, 15)) == date(2024, 3, 18)
+    assert next_trading_day(date(2024, 3, 27)) == date(2024, 4, 2)
+
+
+def test_parse_date_formats():
+    assert parse_date("31.12.2021") == date(2021, 12, 31)
+    assert parse_date("2021-12-31T00:00:00") == date(2021, 12, 31)
+    assert parse_date(20211231) == date(2021, 12, 31)
+    assert parse_date(" 31.12.2021 ") == date(2021, 12, 31)
+
+
+def test_parse_date_rejects_other_text():
+    assert parse_date("") is None
+    assert parse_date(None) is None
+    assert parse_date("31/12/21") is None
+
+
+def test_next_interval_keeps_the_scan_interval_without_dates():
+    schedule = PublishSchedule(SCAN_INTERVAL)
+    now = oslo(2024, 3, 14, 12)
+    assert schedule.next_interval(now) == SCAN_INTERVAL
+    schedule.observe("A", date(2024, 3, 13), now)
+    assert schedule.next_interval(now, ["A", "B"]) == SCAN_INTERVAL
+
+
+def test_next_interval_waits_for_the_publish_window():
+    schedule = PublishSchedule(SCAN_INTERVAL)
+    now = oslo(2024, 3, 14, 10)
+    schedule.observe("A", date(2024, 3, 13), now)
+    expected = oslo(2024, 3, 14) + DEFAULT_PUBLISH_OFFSET
+    assert schedule.next_interval(now, ["A"]) == expected - PUBLISH_WINDOW - now
+
+
+def test_next_interval_polls_in_the_publish_window_and_when_overdue():
+    schedule = PublishSchedule(SCAN_INTERVAL)
+    expected = oslo(2024, 3, 14) + DEFAULT_PUBLISH_OFFSET
+    schedule.observe("A", date(2024, 3, 13), expected)
+    assert schedule.next_interval(expected, ["A"]) == SCAN_INTERVAL
+    overdue = expected + PUBLISH_WINDOW + timedelta(minutes=1)
+    assert schedule.next_interval(overdue, ["A"]) == OVERDUE_INTERVAL
+
+
+def test_observe_learns_the_publish_time():
+    schedule = PublishSchedule(SCAN_INTERVAL)
+    schedule.observe("A", date(2024, 3, 13), oslo(2024, 3, 13, 18))
+    schedule.observe("A", date(2024, 3, 14), oslo(2024, 3, 14, 20))
+    assert DEFAULT_PUBLISH_OFFSET < schedule.offset < timedelta(hours=20)
+    schedule.forget("A")
+    assert schedule.next_interval(oslo(2024, 3, 15, 12)) == SCAN_INTERVAL
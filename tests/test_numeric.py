@@ -0,0 +1,37 @@
+"""Tests of the locale independent number parsing."""
+import pytest
+
+from custom_components.fund_engine.numeric import numeric_attributes, to_float
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (12.5, 12.5),
+        (3, 3.0),
+        ("12.5", 12.5),
+        ("1,23 %", 1.23),
+        ("-0,45 %", -0.45),
+        ("1 234,56", 1234.56),
+        ("1\xa0234,56", 1234.56),
+        ("1,234.56", 1234.56),
+        ("1.234,56", 1234.56),
+        (" 7 ", 7.0),
+    ],
+)
+def test_to_float(value, expected):
+    assert to_float(value) == expected
+
+
+@pytest.mark.parametrize("value", [None, "", "-", "n/a", ["1"]])
+def test_to_float_returns_none_for_other_values(value):
+    assert to_float(value) is None
+
+
+def test_numeric_attributes_converts_only_percentages():
+    attributes = {"1 dag": "1,50 %", "Dato": "14.03.2024", "URL": "https://x"}
+    assert numeric_attributes(attributes) == {
+        "1 dag": 1.5,
+        "Dato": "14.03.2024",
+        "URL": "https://x",
+    }
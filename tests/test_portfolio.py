@@ -0,0 +1,44 @@
+"""Tests of the portfolio total and its weighted returns."""
+from homeassistant.core import State
+
+from custom_components.fund_portfolio import sensor
+
+FUNDS = [
+    {"entity_id": "sensor.a", "units": 10.0},
+    {"entity_id": "sensor.b", "units": 2.0, "rate_entity": "sensor.usd_nok"},
+]
+
+
+def portfolio() -> sensor.FundPortfolioSensor:
+    return sensor.FundPortfolioSensor(
+        "Portfolio", "kr", FUNDS, sensor.DEFAULT_RETURNS
+    )
+
+
+def update(portfolio, entity_id: str, value: str, **attributes) -> bool:
+    changed = portfolio._update_rows(entity_id, State(entity_id, value, attributes))
+    portfolio._compute()
+    return changed
+
+
+def test_state_is_unknown_until_every_fund_and_rate_has_a_value():
+    fund_portfolio = portfolio()
+    update(fund_portfolio, "sensor.a", "100", **{"1 dag": "1,0"})
+    assert fund_portfolio.state is None
+    update(fund_portfolio, "sensor.b", "50", **{"1 dag": "-2"})
+    assert fund_portfolio.state is None
+    update(fund_portfolio, "sensor.usd_nok", "10")
+    assert fund_portfolio.state == 2000.0
+    assert fund_portfolio.extra_state_attributes == {"1 dag": -0.5, "Fond": 2}
+
+
+def test_unavailable_funds_keep_their_last_known_price():
+    fund_portfolio = portfolio()
+    update(fund_portfolio, "sensor.a", "100")
+    update(fund_portfolio, "sensor.b", "50")
+    update(fund_portfolio, "sensor.usd_nok", "10")
+    assert not update(fund_portfolio, "sensor.b", "unavailable")
+    assert not update(fund_portfolio, "sensor.usd_nok", "unknown")
+    assert fund_portfolio.state == 2000.0
+    assert update(fund_portfolio, "sensor.b", "60")
+    assert fund_portfolio.state == 2200.0
@@ -0,0 +1,145 @@
+"""Tests of the retries and the circuit breaker of the fetch engine."""
+import asyncio
+
+import aiohttp
+import pytest
+
+from custom_components.fund_engine import engine
+from custom_components.fund_engine.engine import (
+    BREAKER_THRESHOLD,
+    RETRIES,
+    Breaker,
+    FetchEngine,
+    HostUnavailable,
+    _retry_after,
+)
+
+URL = "https://example.com/fund"
+
+
+class FakeResponse:
+    def __init__(self, status: int, headers: dict = None, body: str = ""):
+        self.status = status
+        self.headers = headers or {}
+        self._body = body
+
+    async def text(self):
+        return self._body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return None
+
+
+class FakeSession:
+    """Answer requests with the given responses, or raise the given errors."""
+
+    def __init__(self, *answers):
+        self._answers = list(answers)
+        self.requests = 0
+
+    def request(self, method, url, **kwargs):
+        self.requests += 1
+        answer = self._answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+@pytest.fixture
+def waits(monkeypatch):
+    """Record the waits between retries instead of sleeping."""
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr(engine.asyncio, "sleep", sleep)
+    return waits
+
+
+def request(session: FakeSession, url: str = URL) -> tuple:
+    return asyncio.run(FetchEngine(None, session=session).async_request("GET", url))
+
+
+def test_retry_after_seconds_and_dates():
+    assert _retry_after("12") == 12.0
+    assert _retry_after("-3") == 0.0
+    assert _retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert _retry_after("soon") is None
+    assert _retry_after(None) is None
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = Breaker()
+    for _ in range(BREAKER_THRESHOLD - 1):
+        breaker.failure()
+    assert not breaker.is_open
+    breaker.failure()
+    assert breaker.is_open
+    breaker.success()
+    assert not breaker.is_open
+    assert breaker.failures == 0
+
+
+def test_breaker_opens_for_the_wait_asked_for():
+    breaker = Breaker()
+    breaker.failure(60)
+    assert breaker.is_open
+    breaker = Breaker()
+    breaker.failure(0)
+    assert not breaker.is_open
+
+
+def test_retries_server_errors(waits):
+    session = FakeSession(FakeResponse(503), FakeResponse(200, body="ok"))
+    status, _, body = request(session)
+    assert (status, body) == (200, "ok")
+    assert session.requests == 2
+    assert len(waits) == 1
+
+
+def test_does_not_retry_client_errors(waits):
+    session = FakeSession(FakeResponse(404))
+    assert request(session)[0] == 404
+    assert session.requests == 1
+    assert not waits
+
+
+def test_waits_as_long_as_retry_after(waits):
+    session = FakeSession(
+        FakeResponse(429, {aiohttp.hdrs.RETRY_AFTER: "20"}), FakeResponse(200)
+    )
+    assert request(session)[0] == 200
+    assert waits == [20.0]
+
+
+def test_gives_up_on_long_retry_after_and_opens_the_breaker(waits):
+    session = FakeSession(FakeResponse(503, {aiohttp.hdrs.RETRY_AFTER: "600"}))
+    fetch_engine = FetchEngine(None, session=session)
+    status, _, _ = asyncio.run(fetch_engine.async_request("GET", URL))
+    assert status == 503
+    assert session.requests == 1
+    assert not waits
+    assert fetch_engine.breaker(URL).is_open
+    with pytest.raises(HostUnavailable):
+        asyncio.run(fetch_engine.async_request("GET", URL + "?id=2"))
+
+
+def test_raises_after_the_last_retry(waits):
+    session = FakeSession(*[aiohttp.ClientConnectionError()] * (RETRIES + 1))
+    fetch_engine = FetchEngine(None, session=session)
+    with pytest.raises(aiohttp.ClientConnectionError):
+        asyncio.run(fetch_engine.async_request("GET", URL))
+    assert session.requests == RETRIES + 1
+    assert len(waits) == RETRIES
+    assert fetch_engine.breaker(URL).failures == 1
+
+
+def test_backoff_grows_with_jitter(waits):
+    session = FakeSession(*[FakeResponse(503)] * (RETRIES + 1))
+    assert request(session)[0] == 503
+    for attempt, wait in enumerate(waits):
+        assert engine.BACKOFF * 2**attempt / 2 <= wait <= engine.BACKOFF * 2**attempt
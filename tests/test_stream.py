@@ -0,0 +1,106 @@
+"""Tests of reading only the page sections a parser needs."""
+import asyncio
+
+from custom_components.fund_engine.engine import CHARSET_HEAD, StreamEnd, StreamReader
+
+END = StreamEnd(("<h1", "</h1>"), ('id="nav"', "</tr>"))
+PAGE = '<html><h1>Fund</h1><table><tr id="nav"><td>NOK 1,23</td></tr></table>'
+TAIL = "<p>footer</p></html>"
+
+
+class FakeContent:
+    def __init__(self, body: bytes, size: int):
+        self._chunks = [body[i:i + size] for i in range(0, len(body), size)]
+        self.read = 0
+
+    async def iter_chunked(self, _):
+        for chunk in self._chunks:
+            self.read += 1
+            yield chunk
+
+
+class FakeResponse:
+    def __init__(self, body: bytes, size: int = 8, charset="utf-8", status=200):
+        self.status = status
+        self.charset = charset
+        self.content = FakeContent(body, size)
+        self.closed = False
+        self._body = body
+
+    async def text(self):
+        return self._body.decode()
+
+    def close(self):
+        self.closed = True
+
+
+def test_find_returns_the_end_of_the_last_section():
+    assert END.find(PAGE + TAIL) == len(PAGE) - len("</table>")
+
+
+def test_find_waits_for_every_section():
+    assert END.find("<h1>Fund</h1>") is None
+    assert END.find('<tr id="nav"><td>1</td></tr>') is None
+
+
+def test_find_ignores_end_markers_before_their_section():
+    assert END.find('</tr></h1><h1>Fund</h1><tr id="nav"></tr>') == 41
+
+
+def test_find_continues_a_growing_text():
+    text = PAGE + TAIL
+    found = [(-1, -1)] * len(END.sections)
+    searched = 0
+    end = None
+    for size in range(3, len(text) + 3, 3):
+        end = END.find(text[:size], found, searched)
+        searched = size
+        if end is not None:
+            break
+    assert end == END.find(text)
+
+
+def test_find_matches_markers_split_between_searches():
+    text = PAGE + TAIL
+    split = text.index('id="nav"') + 3
+    found = [(-1, -1)] * len(END.sections)
+    assert END.find(text[:split], found) is None
+    assert END.find(text, found, split) == END.find(text)
+
+
+def test_reader_cuts_after_the_sections():
+    body = (PAGE + TAIL * 200).encode()
+    response = FakeResponse(body, 16)
+    reader = StreamReader(END)
+    text = asyncio.run(reader(response))
+    assert text == PAGE[: END.find(PAGE)]
+    assert reader.cut
+    assert response.closed
+    assert response.content.read < len(response.content._chunks)
+
+
+def test_reader_returns_whole_pages_without_the_sections():
+    body = ("<html>" + TAIL * 100).encode()
+    reader = StreamReader(END)
+    assert asyncio.run(reader(FakeResponse(body))) == body.decode()
+    assert not reader.cut
+
+
+def test_reader_reads_error_responses_whole():
+    reader = StreamReader(END)
+    response = FakeResponse((PAGE + TAIL).encode(), status=500)
+    assert asyncio.run(reader(response)) == PAGE + TAIL
+    assert not reader.cut
+
+
+def test_reader_decodes_with_the_charset_of_the_page():
+    page = '<meta charset="iso-8859-1"><h1>Børs</h1><tr id="nav"></tr>'
+    body = (page + " " * CHARSET_HEAD + TAIL).encode("iso-8859-1")
+    text = asyncio.run(StreamReader(END)(FakeResponse(body, 7, charset=None)))
+    assert text == page
+
+
+def test_reader_cuts_short_pages_without_a_charset():
+    body = (PAGE + TAIL).encode()
+    text = asyncio.run(StreamReader(END)(FakeResponse(body, 5, charset=None)))
+    assert text == PAGE[: END.find(PAGE)]